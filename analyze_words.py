@@ -1,27 +1,91 @@
-import math
-import sys
-import unicodedata
-import pandas as pd
 import re
-import csv
-import itertools
 import string
-import pickle
-import nltk
-from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.feature_extraction.text import CountVectorizer
-# nltk.download("wordnet") --> uncomment if missing wordnet nltk library
+import functools
+from collections import Counter
+# pandas, nltk, sklearn and multiprocessing are imported by the functions
+# that use them, so that unpickling a vectorizer (which only needs
+# processing) and the startup of main.py stay fast
+# Uncomment the next line if the wordnet nltk library is missing
+# import nltk; nltk.download("wordnet")
 
 
 # Generating global variables
 STOP_PREFIXES = ("@", "#", "http", "&amp")
 PUNCTUATION = string.punctuation + "…"  # Added the special character elipsis
 INTERNAL_PUNCTUATION = set(PUNCTUATION) - {"'"}  # Want to keep apostrophe
-LEMMATIZER = WordNetLemmatizer()
+TOKENIZE_CHUNKSIZE = 500  # Reviews sent to a worker process at a time
+CACHE_SIZE = 2 ** 18  # Distinct words remembered by the token caches
+NON_ENGLISH = re.compile("([^\x00-\x7F])+")
+DIGIT = re.compile(r"\d")
+NUM_HASHED_FEATURES = 2 ** 20  # Columns of the hashed tf_idf array
+FEATURIZERS = ("tfidf", "hashing")
+TOKENIZER_VERSION = "1"  # Bump when processing() output changes
 
 
 # Pre-processing stage
+@functools.lru_cache(maxsize=None)
+def get_lemmatizer():
+    '''
+    Create the WordNet lemmatizer the first time a word is lemmatized,
+    since importing nltk takes longer than most of our programs need
+    to start.
+
+    Returns: WordNetLemmatizer obj
+    '''
+    from nltk.stem import WordNetLemmatizer
+
+    return WordNetLemmatizer()
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def lemmatize(word):
+    '''
+    Lemmatize a lowercase word, remembering the most recent results
+    since the same words occur over and over again in reviews.
+
+    Inputs:
+      - word (str): lowercase word
+
+    Returns: str
+    '''
+    return get_lemmatizer().lemmatize(word)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def clean_word(word):
+    '''
+    Convert one whitespace separated word of a review into its tokens,
+    remembering the most recent results.
+
+    Inputs:
+      - word (str): word from the review text
+
+    Returns: tuple of tokens
+    '''
+    # Handle trailing punctuation
+    word = word.replace("&apos;", "'")
+    word = word.replace("quot;", '"')
+    word = word.replace("&quot", '"')
+    word = word.strip(PUNCTUATION)
+
+    # Handle internal punctuation
+    word_set = set(word)
+    punc_in_word = word_set.intersection(INTERNAL_PUNCTUATION)
+
+    for punc in punc_in_word:
+        word = word.replace(punc, " ")
+
+    tokens = []
+    for word in word.split():
+        word = word.lower()
+        word = lemmatize(word)
+        if (word and not bool(DIGIT.search(word))
+                and not word.startswith(STOP_PREFIXES)):
+            tokens.append(word)
+
+    return tuple(tokens)
+
+
 def processing(text):
     '''
     Convert a text of a review into a list of strings.
@@ -31,62 +95,312 @@ def processing(text):
 
     Returns: list of tokens
     '''
-    text = re.sub("([^\x00-\x7F])+", " ", text)  # Remove non-English words
-    split_text = text.split()
+    text = NON_ENGLISH.sub(" ", text)  # Remove non-English words
     new_text = []
 
-    for word in split_text:
-        # Handle trailing punctuation
-        word = word.replace("&apos;", "'")
-        word = word.replace("quot;", '"')
-        word = word.replace("&quot", '"')
-        word = word.strip(PUNCTUATION)
+    for word in text.split():
+        new_text.extend(clean_word(word))
 
-        # Handle internal punctuation
-        word_set = set(word)
-        punc_in_word = word_set.intersection(INTERNAL_PUNCTUATION)
+    return new_text
 
-        for punc in punc_in_word:
-            word = word.replace(punc, " ")
 
-        for word in word.split():
-            word = word.lower()
-            word = LEMMATIZER.lemmatize(word)
-            if (word and not bool(re.search(r"\d", word))
-                    and not word.startswith(STOP_PREFIXES)):
-                new_text.append(word)
+def cache_stats():
+    '''
+    Report how often the token caches of the current process were hit.
+
+    Returns: dict mapping cache names to dicts of hits, misses,
+             size and hit_rate
+    '''
+    stats = {}
+
+    for name, func in [("lemmatize", lemmatize), ("clean_word", clean_word)]:
+        info = func.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {"hits": info.hits,
+                       "misses": info.misses,
+                       "size": info.currsize,
+                       "hit_rate": info.hits / lookups if lookups else 0.0}
+
+    return stats
+
+
+def tokenize(text):
+    '''
+    Convert a text of a review into a list of tokens exactly as the
+    vectorizers do, i.e. lowercasing the text before processing it.
+
+    Inputs:
+      - text (str): text representing one review
+
+    Returns: list of tokens
+    '''
+    return processing(text.lower())
+
+
+def tokenize_pool(n_jobs=None):
+    '''
+    Start a pool of processes that tokenize_corpus can reuse across
+    calls, so that the token caches of its workers stay warm (a new
+    pool is started by each call otherwise).
+
+    Inputs:
+      - n_jobs (int): number of processes to use (all cores if None,
+                      no pool if 1)
+
+    Returns: ProcessPoolExecutor, or None if n_jobs is 1
+    '''
+    if n_jobs == 1:
+        return None
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=n_jobs)
 
-    return new_text
 
+def tokenize_corpus(corpus, n_jobs=None, executor=None):
+    '''
+    Tokenize every review in a corpus, splitting the work across a
+    pool of processes. Tokens are returned in the original order.
+
+    Inputs:
+      - corpus (list of str): list of reviews
+      - n_jobs (int): number of processes to use (all cores if None,
+                      no pool if 1), if no executor is given
+      - executor (ProcessPoolExecutor): pool started by tokenize_pool,
+                                        used instead of a new one
 
-def get_stop_words(corpus, num_stop_words=20):
+    Returns: list of lists of tokens
+    '''
+    corpus = list(corpus)
+
+    if (len(corpus) <= TOKENIZE_CHUNKSIZE
+            or (executor is None and n_jobs == 1)):
+        return [tokenize(text) for text in corpus]
+
+    if executor is not None:
+        return list(executor.map(tokenize, corpus,
+                                 chunksize=TOKENIZE_CHUNKSIZE))
+
+    with tokenize_pool(n_jobs) as executor:
+        return list(executor.map(tokenize, corpus,
+                                 chunksize=TOKENIZE_CHUNKSIZE))
+
+
+def identity(tokens):
+    '''
+    Return the input unchanged. Used as the tokenizer and preprocessor
+    of vectorizers that are fitted on pre-tokenized reviews.
+
+    Inputs:
+      - tokens (list of str): tokens of one review
+
+    Returns: list of tokens
+    '''
+    return tokens
+
+
+def fit_pretokenized(vectorizer, all_tokens):
+    '''
+    Fit a vectorizer on pre-tokenized reviews, then restore processing
+    as its tokenizer so that it can still transform raw review text
+    (e.g. after being saved and loaded by main.py).
+
+    The stop words are removed from the tokens here rather than by the
+    vectorizer: with identity as its tokenizer, scikit-learn would
+    check them against the wrong tokenizer (warning that they are
+    inconsistent) and then skip the check for processing.
+
+    Inputs:
+      - vectorizer (Vectorizer): CountVectorizer, TfidfVectorizer or
+                                 HashingVectorizer
+      - all_tokens (list of lists of str): tokens of each review
+
+    Returns: sparse matrix
+    '''
+    stop_words = vectorizer.stop_words
+    stop_set = vectorizer.get_stop_words()
+    if stop_set:
+        all_tokens = ([token for token in tokens if token not in stop_set]
+                      for tokens in all_tokens)
+
+    vectorizer.set_params(tokenizer=identity, preprocessor=identity,
+                          lowercase=False, stop_words=None)
+    X = vectorizer.fit_transform(all_tokens)
+    vectorizer.set_params(tokenizer=processing, preprocessor=None,
+                          lowercase=True, stop_words=stop_words)
+
+    return X
+
+
+def rank_words(all_tokens):
+    '''
+    Rank the words of a tokenized corpus from the most to the least
+    frequently occurring, using a single counting pass. Words with the
+    same count keep the order in which they first appear.
+
+    Inputs:
+      - all_tokens (list of lists of str): tokens of each review
+
+    Returns: list of tokens
+    '''
+    word_counts = Counter()
+    for tokens in all_tokens:
+        word_counts.update(tokens)
+
+    return [word for word, _ in word_counts.most_common()]
+
+
+def get_stop_words(corpus, num_stop_words=20, pretokenized=False,
+                   n_jobs=None):
     '''
     Obtain the particular stop words (most frequently occurring
     words) in the sample, which may differ from those in a list
     of generic stop words.
 
-    Line 80-83 adapted from 
-    https://programminghistorian.org/en/lessons/analyzing-documents-with-tfidf
-
     Inputs:
       - corpus (list of str): list of reviews
       - num_stop_words (int): number of stop words to remove
+      - pretokenized (bool): whether corpus is already a list of
+                             lists of tokens (from tokenize_corpus)
+      - n_jobs (int): number of processes used for tokenizing
 
     Returns: list of most common tokens
     '''
-    count_vectorizer = CountVectorizer(tokenizer=processing)
-    X = count_vectorizer.fit_transform(corpus)
+    if not pretokenized:
+        corpus = tokenize_corpus(corpus, n_jobs)
+
+    return rank_words(corpus)[:num_stop_words]
+
+
+def make_hashing_vectorizer(n, stop_words, n_features=NUM_HASHED_FEATURES):
+    '''
+    Create a stateless vectorizer counting the n-grams of reviews in a
+    fixed number of hashed columns.
+
+    Inputs:
+      - n (int): range of n-grams to use
+      - stop_words (list of str): stop words to remove
+      - n_features (int): number of columns
+
+    Returns: HashingVectorizer obj
+    '''
+    from sklearn.feature_extraction.text import HashingVectorizer
 
-    sum_words = X.sum(axis=0)
-    words_freq = [(word, sum_words[0, idx])
-                  for word, idx in count_vectorizer.vocabulary_.items()]
-    words_freq = sorted(words_freq, key=lambda x: x[1], reverse=True)
-    words_freq_no_count = [word for word, _ in words_freq]
+    return HashingVectorizer(stop_words=stop_words,
+                             tokenizer=processing, ngram_range=(1, n),
+                             n_features=n_features, alternate_sign=False,
+                             norm=None)
 
-    return words_freq_no_count[:num_stop_words]
 
+class TokenizedCorpus:
+    '''
+    Reviews and ratings from a CSV file, tokenized once and kept in
+    memory. The word ranking used to choose stop words is also only
+    computed once, so that sweeping over n-gram lengths and numbers
+    of stop words never processes the review text again.
+    '''
 
-def get_df_idf_stops(csv_file, n, num_stop_words):
+    def __init__(self, csv_file, n_jobs=None):
+        '''
+        Read and tokenize the reviews in a CSV file.
+
+        Inputs:
+          - csv_file (str): CSV file containing scraped Yelp reviews
+          - n_jobs (int): number of processes used for tokenizing
+        '''
+        import pandas as pd
+
+        df = pd.read_csv(csv_file)
+        self.all_tokens = tokenize_corpus(df.Text, n_jobs)
+        self.y_values = df.Rating.astype("category")
+        self._ranked_words = None
+
+    def get_stop_words(self, num_stop_words=20):
+        '''
+        Obtain the most frequently occurring words in the corpus.
+
+        Inputs:
+          - num_stop_words (int): number of stop words to remove
+
+        Returns: list of most common tokens
+        '''
+        if self._ranked_words is None:
+            self._ranked_words = rank_words(self.all_tokens)
+
+        return self._ranked_words[:num_stop_words]
+
+    def get_df_idf_stops(self, n, num_stop_words):
+        '''
+        Generate a tokenized array with tf_idf values from the cached
+        tokens, along with the ratings and the vectorizer object.
+
+        Inputs:
+          - n (int): range of n-grams to use
+          - num_stop_words (int): number of stop words to remove
+
+        Returns: list of array (X), series (y_values),
+                 Vectorizer Obj (idf_vectorizer)
+        '''
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        idf_vectorizer = TfidfVectorizer(
+            stop_words=self.get_stop_words(num_stop_words),
+            tokenizer=processing, ngram_range=(1, n))
+        X = fit_pretokenized(idf_vectorizer, self.all_tokens)
+
+        return X, self.y_values, idf_vectorizer
+
+    def get_hashed_idf_stops(self, n, num_stop_words,
+                             n_features=NUM_HASHED_FEATURES):
+        '''
+        Same as get_df_idf_stops, but n-grams are hashed into a fixed
+        number of columns instead of being stored in a vocabulary, so
+        the vectorizer only holds the idf weight of each column. Only
+        differs from get_df_idf_stops when two n-grams share a column.
+
+        Inputs:
+          - n (int): range of n-grams to use
+          - num_stop_words (int): number of stop words to remove
+          - n_features (int): number of columns of the array
+
+        Returns: list of array (X), series (y_values),
+                 Pipeline obj (hashing vectorizer and idf weights)
+        '''
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.pipeline import make_pipeline
+
+        hashing_vectorizer = make_hashing_vectorizer(
+            n, self.get_stop_words(num_stop_words), n_features)
+        counts = fit_pretokenized(hashing_vectorizer, self.all_tokens)
+        idf_transformer = TfidfTransformer()
+        X = idf_transformer.fit_transform(counts)
+
+        return (X, self.y_values,
+                make_pipeline(hashing_vectorizer, idf_transformer))
+
+    def get_features(self, n, num_stop_words, featurizer="tfidf"):
+        '''
+        Generate the tf_idf array, ratings and vectorizer with the
+        chosen featurization.
+
+        Inputs:
+          - n (int): range of n-grams to use
+          - num_stop_words (int): number of stop words to remove
+          - featurizer (str): "tfidf" for a vocabulary of n-grams or
+                              "hashing" for hashed n-grams
+
+        Returns: list of array (X), series (y_values), Vectorizer obj
+        '''
+        if featurizer == "tfidf":
+            return self.get_df_idf_stops(n, num_stop_words)
+        if featurizer == "hashing":
+            return self.get_hashed_idf_stops(n, num_stop_words)
+
+        raise ValueError("featurizer must be one of {}, not {!r}".format(
+            FEATURIZERS, featurizer))
+
+
+def get_df_idf_stops(csv_file, n, num_stop_words, n_jobs=None):
     '''
     Given a CSV file containing food reviews and rating, generate a
     tokenized array with tf_idf values. Also generate a series of
@@ -96,21 +410,14 @@ def get_df_idf_stops(csv_file, n, num_stop_words):
         csv_file (str): CSV file containing scraped Yelp reviews
         n (int): range of n-grams to use
         num_stop_words (int): number of stop words to remove
+        n_jobs (int): number of processes used for tokenizing
 
     Returns: list of array (X), series (y_values), 
              Vectorizer Obj (idf_vectorizer)
     '''
-    df = pd.read_csv(csv_file)
-    corpus = df.Text
-    stop_words = get_stop_words(corpus, num_stop_words)
-
-    idf_vectorizer = TfidfVectorizer(stop_words=stop_words,
-                                     tokenizer=processing,
-                                     ngram_range=(1, n))
-    X = idf_vectorizer.fit_transform(corpus)
-    y_values = df.Rating.astype("category")
+    corpus = TokenizedCorpus(csv_file, n_jobs)
 
-    return X, y_values, idf_vectorizer
+    return corpus.get_df_idf_stops(n, num_stop_words)
 
 
 # -----------------------------------------------------------------------------
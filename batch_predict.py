@@ -0,0 +1,105 @@
+import sys
+import time
+import argparse
+import pandas as pd
+from predictor import RatingPredictor
+
+
+def read_reviews(in_file, chunk_size, text_column="Text"):
+    '''
+    Stream a CSV or JSONL file of reviews in chunks, so that only one
+    chunk is held in memory at a time.
+
+    Inputs:
+      - in_file (str): CSV or JSONL (.jsonl/.json) file of reviews
+      - chunk_size (int): number of reviews per chunk
+      - text_column (str): name of the column containing review text
+
+    Returns: generator of DataFrames
+    '''
+    if in_file.endswith((".jsonl", ".json")):
+        reader = pd.read_json(in_file, lines=True, chunksize=chunk_size,
+                              dtype={text_column: str})
+    else:
+        reader = pd.read_csv(in_file, chunksize=chunk_size,
+                             dtype={text_column: str})
+
+    with reader:
+        for chunk in reader:
+            chunk[text_column] = chunk[text_column].fillna("")
+            yield chunk
+
+
+def score_file(in_file, out_csv, predictor=None, chunk_size=10000,
+               text_column="Text", id_column=None):
+    '''
+    Suggest star ratings for every review in a CSV or JSONL file and
+    write them to a CSV file as each chunk is scored. Each chunk is
+    transformed into one sparse matrix and scored with a single call
+    to the model, and the rows per second are printed as it goes.
+
+    Inputs:
+      - in_file (str): CSV or JSONL (.jsonl/.json) file of reviews
+      - out_csv (str): CSV file name for the predictions
+      - predictor (RatingPredictor): preloaded predictor, created
+                                     from the PKL files (without
+                                     autocorrect) if not given
+      - chunk_size (int): number of reviews scored at a time
+      - text_column (str): name of the column containing review text
+      - id_column (str): name of a column to copy into the output
+                         next to each prediction, the row number
+                         is used if not given
+
+    Returns: int (number of reviews scored), writes to CSV file
+    '''
+    if predictor is None:
+        predictor = RatingPredictor(autocorrect=False)
+
+    total_rows = 0
+    start = time.perf_counter()
+
+    with open(out_csv, "w", newline="") as f:
+        for i, chunk in enumerate(read_reviews(in_file, chunk_size,
+                                               text_column)):
+            predictions = predictor.predict_many(chunk[text_column])
+
+            if id_column:
+                ids = chunk[id_column].values
+            else:
+                ids = range(total_rows, total_rows + len(chunk))
+            out_df = pd.DataFrame({id_column or "Row": ids,
+                                   "Prediction": predictions})
+            out_df.to_csv(f, index=False, header=(i == 0))
+
+            total_rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            print("Scored {} reviews | {:.0f} rows/s".format(
+                total_rows, total_rows / elapsed), file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print("Finished scoring {} reviews in {:.1f}s ({:.0f} rows/s)".format(
+        total_rows, elapsed, total_rows / elapsed if elapsed else 0),
+        file=sys.stderr)
+
+    return total_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Suggest star ratings for a CSV or JSONL review file.")
+    parser.add_argument("in_file", help="CSV or JSONL file of reviews")
+    parser.add_argument("out_csv", help="CSV file for the predictions")
+    parser.add_argument("--chunk-size", type=int, default=10000,
+                        help="number of reviews scored at a time")
+    parser.add_argument("--text-column", default="Text",
+                        help="column containing the review text")
+    parser.add_argument("--id-column", default=None,
+                        help="column copied next to each prediction")
+    parser.add_argument("--autocorrect", action="store_true",
+                        help="fix spelling errors before scoring (slow)")
+    args = parser.parse_args()
+
+    score_file(args.in_file, args.out_csv,
+               predictor=RatingPredictor(autocorrect=args.autocorrect),
+               chunk_size=args.chunk_size, text_column=args.text_column,
+               id_column=args.id_column)
@@ -0,0 +1,60 @@
+'''
+Compare the vocabulary based tf_idf featurization with the hashed one:
+weighted accuracy, peak memory while building the features, and the
+size of the saved vectorizer.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_featurizers test_data/merged_data.csv
+'''
+import io
+import sys
+import time
+import tracemalloc
+import joblib
+from sklearn.model_selection import train_test_split
+from analyze_words import TokenizedCorpus, FEATURIZERS
+from model import get_weighted_accuracy, RANDOM_SEED
+
+
+def main(csv_file, n=2, num_stop_words=0, alpha=0.0001,
+         testing_fraction=0.2):
+    '''
+    Print the accuracy, memory and artifact size of each featurizer.
+
+    Inputs:
+      - csv_file (str): CSV file containing scraped Yelp reviews
+      - n (int): range of n-grams to use
+      - num_stop_words (int): number of stop words to remove
+      - alpha (float): constant that multiplies regularization term
+      - testing_fraction (float): proportion of data reserved for testing
+    '''
+    corpus = TokenizedCorpus(csv_file)
+    corpus.get_stop_words(num_stop_words)
+
+    print("{:8} {:>9} {:>9} {:>11} {:>12}".format(
+        "mode", "accuracy", "build s", "peak MB", "pickle MB"))
+    for featurizer in FEATURIZERS:
+        tracemalloc.start()
+        start = time.perf_counter()
+        X, y_values, vectorizer = corpus.get_features(n, num_stop_words,
+                                                      featurizer)
+        build_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        x_train, x_test, y_train, y_test = \
+            train_test_split(X, y_values, test_size=testing_fraction,
+                             random_state=RANDOM_SEED)
+        accuracy = get_weighted_accuracy(x_train, x_test, y_train, y_test,
+                                         alpha)
+
+        artifact = io.BytesIO()
+        joblib.dump(vectorizer, artifact)
+
+        print("{:8} {:9.4f} {:9.2f} {:11.1f} {:12.2f}".format(
+            featurizer, accuracy, build_time, peak / 2 ** 20,
+            artifact.tell() / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
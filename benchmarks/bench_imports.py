@@ -0,0 +1,93 @@
+'''
+Track how long our modules take to import, and how long main.py takes
+to show its prompt, using python's -X importtime option in fresh
+interpreters.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_imports
+'''
+import sys
+import time
+import subprocess
+
+
+MODULES = ["main", "predictor", "spelling", "analyze_words",
+           "compact_model", "server", "batch_predict", "model"]
+
+
+def import_times(module):
+    '''
+    Import a module in a fresh interpreter and collect the cumulative
+    import time of everything it imports.
+
+    Inputs:
+      - module (str): name of the module
+
+    Returns: dict mapping imported module to microseconds (None if the
+             module could not be imported)
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import " + module],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def time_to_prompt(repeats=3):
+    '''
+    Measure the time main.py takes to start, show its prompt and exit
+    on an empty input.
+
+    Inputs:
+      - repeats (int): number of runs (the fastest is kept)
+
+    Returns: float (seconds)
+    '''
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "main.py", "--repl"], input="",
+                       capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main(modules=MODULES, num_slowest=5):
+    '''
+    Print the import time of each module and its slowest imports.
+
+    Inputs:
+      - modules (list of str): modules to import
+      - num_slowest (int): number of slowest imports listed per module
+    '''
+    print("{:15} {:>10}  {}".format("module", "import ms", "slowest imports"))
+    for module in modules:
+        times = import_times(module)
+        if times is None:
+            print("{:15} {:>10}".format(module, "failed"))
+            continue
+
+        slowest = sorted((name for name in times if name != module),
+                         key=times.get, reverse=True)[:num_slowest]
+        print("{:15} {:10.1f}  {}".format(
+            module, times.get(module, 0) / 1000,
+            ", ".join("{} {:.0f}".format(name, times[name] / 1000)
+                      for name in slowest)))
+
+    print("main.py time to prompt: {:.0f} ms".format(time_to_prompt() * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or MODULES)
@@ -0,0 +1,100 @@
+'''
+Compare the time and memory needed to extract the ld+json object from
+saved Yelp pages with the crawler's extract_ld_json and with a full
+BeautifulSoup tree.
+
+Run from the repository root, on the fixture page or on saved pages:
+    python3 -m benchmarks.bench_ld_json
+    python3 -m benchmarks.bench_ld_json saved_pages/*.html
+'''
+import os
+import sys
+import json
+import time
+import tracemalloc
+import bs4
+from crawl_and_scrape import extract_ld_json
+
+
+FIXTURES = [os.path.join(os.path.dirname(__file__), "fixtures",
+                         "yelp_review_page.html")]
+
+
+def soup_ld_json(html):
+    '''
+    Extract the ld+json object from a full BeautifulSoup tree.
+
+    Inputs:
+      - html (bytes): HTML of the page
+
+    Returns: JSON object or None
+    '''
+    tag = bs4.BeautifulSoup(html, "lxml").find("script",
+                                               type="application/ld+json")
+
+    return json.loads(tag.contents[0]) if tag else None
+
+
+def measure(func, html, repeats):
+    '''
+    Measure the mean run time and peak memory of func on one page.
+
+    Inputs:
+      - func (function): extraction function
+      - html (bytes): HTML of the page
+      - repeats (int): number of timed runs
+
+    Returns: float (seconds), float (peak MB), JSON object
+    '''
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func(html)
+    seconds = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    result = func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak / 2 ** 20, result
+
+
+def main(filenames, repeats=5):
+    '''
+    Print the time and peak memory per page of both extraction paths.
+
+    Inputs:
+      - filenames (list of str): saved HTML pages
+      - repeats (int): number of timed runs per page
+    '''
+    totals = {"scan": [0.0, 0.0], "soup": [0.0, 0.0]}
+
+    print("{:40} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+        "page", "scan ms", "scan MB", "soup ms", "soup MB", "same"))
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            html = f.read()
+
+        scan_s, scan_mb, scan_result = measure(extract_ld_json, html, repeats)
+        soup_s, soup_mb, soup_result = measure(soup_ld_json, html, repeats)
+        totals["scan"][0] += scan_s
+        totals["scan"][1] += scan_mb
+        totals["soup"][0] += soup_s
+        totals["soup"][1] += soup_mb
+
+        print("{:40} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:>6}".format(
+            filename[-40:], scan_s * 1000, scan_mb, soup_s * 1000, soup_mb,
+            str(scan_result == soup_result)))
+
+    if filenames:
+        num_pages = len(filenames)
+        print("{:40} {:10.2f} {:10.2f} {:10.2f} {:10.2f}".format(
+            "mean per page",
+            totals["scan"][0] * 1000 / num_pages,
+            totals["scan"][1] / num_pages,
+            totals["soup"][0] * 1000 / num_pages,
+            totals["soup"][1] / num_pages))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or FIXTURES)
@@ -0,0 +1,79 @@
+'''
+Compare the per-review latency of suggesting a star rating without
+spelling correction, with the SymSpell corrector, and with TextBlob's
+correction (what main.py used before).
+
+Run from the repository root:
+    python3 -m benchmarks.bench_spelling test_data/merged_data.csv
+'''
+import sys
+import time
+import numpy as np
+import pandas as pd
+from textblob import TextBlob
+from predictor import RatingPredictor
+
+
+def measure(predict, reviews):
+    '''
+    Time the prediction of each review on its own.
+
+    Inputs:
+      - predict (function): function taking a review and returning
+                            its star rating
+      - reviews (list of str): review texts
+
+    Returns: array of floats (seconds per review), list of int
+    '''
+    latencies = []
+    ratings = []
+    for review in reviews:
+        start = time.perf_counter()
+        ratings.append(predict(review))
+        latencies.append(time.perf_counter() - start)
+
+    return np.array(latencies), ratings
+
+
+def main(csv_file, num_reviews=200):
+    '''
+    Print the mean, median and 99th percentile latency of each mode,
+    and how many of its ratings differ from those without correction.
+
+    Inputs:
+      - csv_file (str): CSV file containing scraped Yelp reviews
+      - num_reviews (int): number of reviews scored by each mode
+    '''
+    reviews = list(pd.read_csv(csv_file, usecols=["Text"], nrows=num_reviews)
+                   .Text.fillna("").astype(str))
+
+    plain = RatingPredictor(autocorrect=False)
+    start = time.perf_counter()
+    symspell = RatingPredictor()
+    build_time = time.perf_counter() - start
+
+    modes = {"none": plain.predict,
+             "symspell": symspell.predict,
+             "textblob": lambda review: plain.predict(
+                 str(TextBlob(review).correct()))}
+
+    print("SymSpell index built in {:.2f}s".format(build_time))
+    print("{:10} {:>10} {:>10} {:>10} {:>8}".format(
+        "mode", "mean ms", "p50 ms", "p99 ms", "changed"))
+    baseline = None
+    for mode, predict in modes.items():
+        latencies, ratings = measure(predict, reviews)
+        if baseline is None:
+            baseline = ratings
+        changed = sum(a != b for a, b in zip(ratings, baseline))
+
+        print("{:10} {:10.2f} {:10.2f} {:10.2f} {:8}".format(
+            mode, latencies.mean() * 1000,
+            np.percentile(latencies, 50) * 1000,
+            np.percentile(latencies, 99) * 1000, changed))
+
+    print("SymSpell cache:", symspell.corrector.cache_stats())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
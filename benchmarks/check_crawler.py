@@ -0,0 +1,189 @@
+'''
+Check the concurrent crawler against a stub HTTP server on 127.0.0.1
+serving the fixture pages: one page listing two restaurants (with
+relative links, plus links the crawler must skip), pages listing no
+restaurants, and the same review page for every restaurant. The check
+asserts the CSV rows written for each restaurant, the minimum spacing
+between requests set by the token bucket and the limit on requests in
+flight per host.
+
+Run from the repository root:
+    python3 -m benchmarks.check_crawler
+'''
+import os
+import csv
+import time
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from crawl_and_scrape import (crawl_and_scrape_concurrent, extract_ld_json,
+                              NEWEST_FIRST)
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+LISTING_PAGE = os.path.join(FIXTURE_DIR, "yelp_listing_page.html")
+LAST_LISTING_PAGE = os.path.join(FIXTURE_DIR, "yelp_listing_last_page.html")
+REVIEW_PAGE = os.path.join(FIXTURE_DIR, "yelp_review_page.html")
+RESTAURANTS = ["/biz/fixture-noodle-bar-fixture-city",
+               "/biz/fixture-taqueria-fixture-city"]
+LATENCY = 0.1  # seconds the stub server takes per page
+SPACING_TOLERANCE = 0.8  # fraction of 1 / requests_per_second allowed
+
+
+def read_fixture(filename):
+    '''
+    Read a fixture page.
+
+    Inputs:
+      - filename (str): HTML file
+
+    Returns: bytes
+    '''
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Serve the fixture pages like Yelp would, and record the time at
+    which each request arrives and the number of requests in flight.
+    '''
+
+    def do_GET(self):
+        '''
+        Serve the listing page for the first page of search results,
+        the last listing page for the others, and the review page for
+        the pages of reviews of a restaurant (404 for anything else).
+        '''
+        server = self.server
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+
+        # Leave before answering, as the crawler may send its next
+        # request as soon as it has read the answer
+        try:
+            time.sleep(LATENCY)
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if url.path == "/search":
+                page = (server.listing_page if query.get("start") == ["0"]
+                        else server.last_listing_page)
+            elif url.path in RESTAURANTS and "start" in query:
+                page = server.review_page
+            else:
+                page = None
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+        if page is None:
+            self.send_error(404)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        '''
+        Keep the stub server quiet.
+        '''
+
+
+def start_server():
+    '''
+    Start the stub server on a free port of 127.0.0.1 in a background
+    thread.
+
+    Returns: ThreadingHTTPServer
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.listing_page = read_fixture(LISTING_PAGE)
+    server.last_listing_page = read_fixture(LAST_LISTING_PAGE)
+    server.review_page = read_fixture(REVIEW_PAGE)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def main(requests_per_second=20.0, per_host=2, max_revs_per_resto=40):
+    '''
+    Crawl the stub server and check what the crawler wrote and how it
+    spaced its requests. Raise AssertionError if a check fails.
+
+    Inputs:
+      - requests_per_second (float): request rate of the crawler
+      - per_host (int): maximum concurrent requests per host
+      - max_revs_per_resto (int): max number of reviews scraped per
+                                  restaurant (a multiple of the 20
+                                  reviews on the review page)
+    '''
+    server = start_server()
+    host = "http://127.0.0.1:{}".format(server.server_address[1])
+    city_url = host + "/search?find_loc=Fixture+City"
+
+    reviews = extract_ld_json(server.review_page)["review"]
+    num_pages = max_revs_per_resto // len(reviews)
+    expected_rows = [[str(review["reviewRating"]["ratingValue"]),
+                      review["description"]]
+                     for review in reviews] * num_pages
+
+    try:
+        with tempfile.TemporaryDirectory() as csv_dir:
+            csv_repo = os.path.join(csv_dir, "resto_")
+            crawl_and_scrape_concurrent(
+                city_url, csv_repo, counter=1,
+                max_revs_per_resto=max_revs_per_resto,
+                requests_per_second=requests_per_second, per_host=per_host)
+
+            # Restaurants are numbered in the order of their sorted links
+            for i, restaurant in enumerate(RESTAURANTS):
+                with open(csv_repo + str(i) + ".csv", newline="") as f:
+                    rows = list(csv.reader(f))
+                assert rows == expected_rows, (
+                    "{}: {} rows written, expected {}".format(
+                        restaurant, len(rows), len(expected_rows)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    times = sorted(arrival for arrival, _ in server.requests)
+    paths = sorted(path for _, path in server.requests)
+    expected_paths = sorted(
+        ["/search?find_loc=Fixture+City&start=" + str(i)
+         for i in range(0, 250, 10)]
+        + [restaurant + NEWEST_FIRST + str(i) for restaurant in RESTAURANTS
+           for i in range(0, max_revs_per_resto, len(reviews))])
+    assert paths == expected_paths, (
+        "unexpected requests: {}".format(
+            sorted(set(paths) ^ set(expected_paths))))
+
+    min_spacing = min(later - earlier
+                      for earlier, later in zip(times, times[1:]))
+    assert min_spacing >= SPACING_TOLERANCE / requests_per_second, (
+        "requests {:.3f}s apart, rate limit is {:.3f}s".format(
+            min_spacing, 1 / requests_per_second))
+    assert server.max_in_flight <= per_host, (
+        "{} requests in flight, per host limit is {}".format(
+            server.max_in_flight, per_host))
+
+    print("{} requests, {} restaurants with {} reviews each".format(
+        len(times), len(RESTAURANTS), len(expected_rows)))
+    print("minimum spacing {:.3f}s (limit {:.3f}s), "
+          "at most {} in flight (limit {})".format(
+              min_spacing, 1 / requests_per_second,
+              server.max_in_flight, per_host))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import hashlib
+from collections import Counter
+import numpy as np
+from analyze_words import processing
+
+
+MODEL_FILE = "optimal_args/final_model.pkl"
+VECTORIZER_FILE = "optimal_args/vectorizer.pkl"
+SELECTOR_FILE = "optimal_args/selector.pkl"
+COMPACT_DIR = "optimal_args/compact/"
+ARRAYS = ["idf", "coef", "intercept", "pruned_hashes", "pruned_idf"]
+
+
+def hash_term(term):
+    '''
+    Hash an n-gram into 64 bits.
+
+    Inputs:
+      - term (str): n-gram
+
+    Returns: int
+    '''
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"),
+                                          digest_size=8).digest(), "little")
+
+
+def export_compact(out_dir=COMPACT_DIR, model_file=MODEL_FILE,
+                   vectorizer_file=VECTORIZER_FILE,
+                   selector_file=SELECTOR_FILE):
+    '''
+    Fold the saved vectorizer, selector and model into a compact
+    artifact for CompactScorer: the n-grams kept by the selector with
+    their idf weights, and the model's coefficients and intercepts as
+    .npy arrays (which can be memory-mapped). The n-grams dropped by
+    the selector carry no weight, but still count towards the length
+    by which each review's tf_idf row is normalized, so only a 64-bit
+    hash and the idf weight of each of them are kept.
+
+    Inputs:
+      - out_dir (str): directory of the compact artifact
+      - model_file (str): PKL file of the trained model
+      - vectorizer_file (str): PKL file of the fitted vectorizer
+      - selector_file (str): PKL file of the fitted feature selector
+                             (None if the model uses every n-gram)
+
+    Returns: int (number of n-grams kept), writes files
+    '''
+    # Only needed to unpickle the full model
+    import joblib
+
+    model = joblib.load(model_file)
+    vectorizer = joblib.load(vectorizer_file)
+
+    if not hasattr(vectorizer, "vocabulary_"):
+        raise ValueError("Hashed vectorizers have no vocabulary to prune")
+    if (vectorizer.analyzer != "word" or vectorizer.tokenizer is not processing
+            or vectorizer.norm not in ("l2", None)):
+        raise ValueError("Only word n-grams tokenized by processing with "
+                         "l2 or no normalization can be exported")
+
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+
+    is_kept = np.ones(len(terms), dtype=bool)
+    if selector_file:
+        is_kept = joblib.load(selector_file).get_support()
+
+    idf = (vectorizer.idf_ if vectorizer.use_idf
+           else np.ones(len(terms)))
+    pruned_hashes = np.array([hash_term(term) for term in terms[~is_kept]],
+                             dtype=np.uint64)
+    order = np.argsort(pruned_hashes)
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {"idf": idf[is_kept],
+              "coef": model.coef_,
+              "intercept": model.intercept_,
+              "pruned_hashes": pruned_hashes[order],
+              "pruned_idf": idf[~is_kept][order]}
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, name + ".npy"),
+                np.ascontiguousarray(arrays[name], dtype=(
+                    np.uint64 if name == "pruned_hashes" else np.float64)))
+
+    stop_words = vectorizer.get_stop_words()
+    meta = {"terms": terms[is_kept].tolist(),
+            "classes": np.asarray(model.classes_).tolist(),
+            "ngram_range": list(vectorizer.ngram_range),
+            "stop_words": sorted(stop_words) if stop_words else [],
+            "lowercase": vectorizer.lowercase,
+            "binary": vectorizer.binary,
+            "sublinear_tf": vectorizer.sublinear_tf,
+            "norm": vectorizer.norm}
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    return int(is_kept.sum())
+
+
+class CompactScorer:
+    '''
+    Suggest star ratings from the compact artifact written by
+    export_compact, with the same predictions as RatingPredictor without
+    spelling correction. It needs neither sklearn nor the full
+    vocabulary: each review's n-grams are counted, weighted by idf and
+    normalized as the vectorizer does, and only the kept n-grams are
+    multiplied by the model's coefficients.
+    '''
+
+    def __init__(self, directory=COMPACT_DIR, mmap_mode="r"):
+        '''
+        Load the compact artifact.
+
+        Inputs:
+          - directory (str): directory of the compact artifact
+          - mmap_mode (str): how the arrays are memory-mapped (read
+                             into memory if None)
+        '''
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.columns = {term: i for i, term in enumerate(meta["terms"])}
+        self.classes = meta["classes"]
+        self.min_n, self.max_n = meta["ngram_range"]
+        self.stop_words = frozenset(meta["stop_words"])
+        self.lowercase = meta["lowercase"]
+        self.binary = meta["binary"]
+        self.sublinear_tf = meta["sublinear_tf"]
+        self.norm = meta["norm"]
+
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory,
+                                                     name + ".npy"),
+                                        mmap_mode=mmap_mode))
+
+    def count_ngrams(self, review):
+        '''
+        Count the n-grams of a review like the vectorizer's analyzer.
+
+        Inputs:
+          - review (str): review text
+
+        Returns: Counter
+        '''
+        tokens = processing(review.lower() if self.lowercase else review)
+        if self.stop_words:
+            tokens = [token for token in tokens
+                      if token not in self.stop_words]
+
+        counts = Counter()
+        for n in range(self.min_n, self.max_n + 1):
+            counts.update(" ".join(tokens[i:i + n])
+                          for i in range(len(tokens) - n + 1))
+
+        return counts
+
+    def weigh(self, review):
+        '''
+        Compute the normalized tf_idf weights of the kept n-grams of a
+        review.
+
+        Inputs:
+          - review (str): review text
+
+        Returns: array of ints (columns), array of floats (weights)
+        '''
+        columns = []
+        weights = []
+        pruned = []
+        for term, count in self.count_ngrams(review).items():
+            if self.binary:
+                count = 1
+            elif self.sublinear_tf:
+                count = 1 + np.log(count)
+
+            column = self.columns.get(term)
+            if column is not None:
+                columns.append(column)
+                weights.append(count * self.idf[column])
+            else:
+                pruned.append((hash_term(term), count))
+
+        columns = np.array(columns, dtype=np.intp)
+        weights = np.array(weights, dtype=np.float64)
+
+        if self.norm == "l2":
+            squared_norm = (weights ** 2).sum()
+            if pruned and len(self.pruned_hashes):
+                hashes = np.array([h for h, _ in pruned], dtype=np.uint64)
+                counts = np.array([c for _, c in pruned], dtype=np.float64)
+                positions = np.minimum(
+                    np.searchsorted(self.pruned_hashes, hashes),
+                    len(self.pruned_hashes) - 1)
+                in_vocabulary = self.pruned_hashes[positions] == hashes
+                squared_norm += ((counts[in_vocabulary]
+                                  * self.pruned_idf[positions[in_vocabulary]])
+                                 ** 2).sum()
+            if squared_norm > 0:
+                weights /= np.sqrt(squared_norm)
+
+        return columns, weights
+
+    def decision_function(self, reviews):
+        '''
+        Compute the model's score of each rating for each review.
+
+        Inputs:
+          - reviews (list of str): review texts
+
+        Returns: array (one row per review)
+        '''
+        scores = np.empty((len(reviews), len(self.intercept)))
+        for i, review in enumerate(reviews):
+            columns, weights = self.weigh(review)
+            scores[i] = self.coef[:, columns] @ weights + self.intercept
+
+        return scores
+
+    def predict_many(self, reviews):
+        '''
+        Suggest a star rating for each review.
+
+        Inputs:
+          - reviews (list of str): review texts
+
+        Returns: list of int
+        '''
+        reviews = list(reviews)
+        if not reviews:
+            return []
+
+        scores = self.decision_function(reviews)
+        if scores.shape[1] == 1:
+            best = (scores[:, 0] > 0).astype(int)
+        else:
+            best = scores.argmax(axis=1)
+
+        return [int(self.classes[i]) for i in best]
+
+    def predict(self, review):
+        '''
+        Suggest a star rating for a single review.
+
+        Inputs:
+          - review (str): review text
+
+        Returns: int
+        '''
+        return self.predict_many([review])[0]
+
+
+if __name__ == "__main__":
+    num_kept = export_compact()
+    print("Exported {} n-grams to {}".format(num_kept, COMPACT_DIR))
+
+    start = time.perf_counter()
+    scorer = CompactScorer()
+    print("Loaded in {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+    # Check the predictions against the full model on a CSV of reviews
+    if len(sys.argv) > 1:
+        import pandas as pd
+        from predictor import RatingPredictor
+
+        reviews = list(pd.read_csv(sys.argv[1], usecols=["Text"])
+                       .Text.fillna("").astype(str))
+        expected = RatingPredictor(autocorrect=False).predict_many(reviews)
+        different = sum(a != b for a, b in
+                        zip(scorer.predict_many(reviews), expected))
+        print("{} of {} predictions differ".format(different, len(reviews)))
@@ -1,44 +1,177 @@
+import os
 import bs4
 import json
 import csv
 import re
 import time
 import random
-from util import convert_if_relative_url, read_url
+import hashlib
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from util import convert_if_relative_url, read_url, PoliteFetcher
+from crawl_state import CrawlState, HtmlCache
 
 
-def try_(counter, find_links, soup):
+RETRY_BASE_DELAY = 3  # Seconds slept before the first retry of a page
+RETRY_MAX_DELAY = 60  # Maximum seconds slept between two retries
+RETRY_TIME_BUDGET = 120  # Seconds after which to give up on a page
+MAX_BLOCK_PAGE_SIZE = 20000  # Real pages are much larger than block pages
+BLOCK_MARKERS = (b"captcha", b"unusual activity", b"access denied")
+
+LD_JSON_SCRIPT = re.compile(
+    rb"<script[^>]*?\stype=[\"']?application/ld\+json[\"']?[^>]*>"
+    rb"(.*?)</script\s*>", re.IGNORECASE | re.DOTALL)
+
+REVIEWS_PER_PAGE = 20
+NEWEST_FIRST = "?sort_by=date_desc&start="  # Review pages, newest first
+
+DEAD_LETTERS = []  # (URL, reason) of pages given up on
+
+
+def extract_ld_json(html):
+    '''
+    Extract and decode the first <script type="application/ld+json">
+    element of a page. The raw HTML is scanned directly instead of
+    building a full BeautifulSoup tree, which is only done as a
+    fallback if the scan fails.
+
+    Inputs:
+      - html (bytes or str): HTML of the page
+
+    Returns: decoded JSON object if found, None otherwise
+    '''
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+
+    match = LD_JSON_SCRIPT.search(html)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except ValueError:
+            pass
+
+    tag = bs4.BeautifulSoup(html, "lxml").find("script",
+                                               type="application/ld+json")
+    if not tag or not tag.contents:
+        return None
+
+    try:
+        return json.loads(tag.contents[0])
+    except ValueError:
+        return None
+
+
+def extract(find_links, html):
     '''
-    Repeatedly attempt to extract link tags or script tags from a page
-    until succeeding or exceeding the maximum number of attempts.
+    Extract link tags or the decoded ld+json object from a page.
 
     Inputs:
+      - find_links (Bool): whether to extract link tags or the
+                           ld+json object
+      - html (bytes or str): HTML of the page
+
+    Returns: tags (Tag) or JSON object if found, None otherwise
+    '''
+    if find_links:
+        tags = bs4.BeautifulSoup(html, "lxml").find_all("a", href=True)
+    else:
+        tags = extract_ld_json(html)
+
+    return tags or None
+
+
+def is_blocked(html):
+    '''
+    Determine if Yelp returned an empty page or a block page (a short
+    page asking to prove that we are not a robot) instead of the page
+    requested.
+
+    Inputs:
+      - html (bytes or str): HTML of the page
+
+    Returns: Bool
+    '''
+    if not html:
+        return True
+    if isinstance(html, str):
+        html = html.encode("utf-8", "ignore")
+    if len(html) > MAX_BLOCK_PAGE_SIZE:
+        return False
+
+    html = html.lower()
+    return any(marker in html for marker in BLOCK_MARKERS)
+
+
+def fetch_and_extract(url, counter, find_links, fetch=read_url,
+                      time_budget=RETRY_TIME_BUDGET):
+    '''
+    Fetch a page and extract link tags or the ld+json object from
+    it. If the page is blocked or the tags are missing, fetch the page
+    again after an exponentially growing, randomly jittered sleep,
+    until succeeding, exceeding the maximum number of attempts or
+    running out of time. Pages that are given up on are added to
+    DEAD_LETTERS so that they can be retried later.
+
+    Inputs:
+      - url (str): URL
       - counter (int): if the program gets blocked by Yelp,
                        how many times should it try again
                        before giving up and skipping (higher
                        number corresponds to longer run-time
                        but fewer pages skipped)
-      - find_links (Bool): whether to extract link tags or script tags
-      - soup (BeautifulSoup): soup object
+      - find_links (Bool): whether to extract link tags or the
+                           ld+json object
+      - fetch (function): function taking a URL and returning HTML
+      - time_budget (float): seconds after which to give up on the page
 
-    Returns: tags (Tag) if found, None otherwise
+    Returns: tags (Tag) or JSON object if found, None otherwise
     '''
-    for _ in range(counter):
-        if find_links:
-            tags = soup.find_all("a", href=True)
-        else:
-            tags = soup.find("script", type="application/ld+json")
+    start = time.monotonic()
 
-        if tags:
-            return tags
+    num_attempts = max(counter, 1)
+    for attempt in range(num_attempts):
+        html = fetch(url)
+        blocked = is_blocked(html)
 
-        # Random sleep to avoid being banned by Yelp
-        time.sleep(random.randint(3, 5))
+        if not blocked:
+            tags = extract(find_links, html)
+            if tags:
+                return tags
+
+        # No point in waiting after the last attempt
+        if attempt == num_attempts - 1:
+            break
+
+        # Exponential backoff with jitter to avoid being banned by Yelp
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        if time.monotonic() - start + delay > time_budget:
+            break
+        time.sleep(delay)
+
+    DEAD_LETTERS.append((url, "blocked" if blocked else "missing tags"))
 
     return None
 
 
-def get_links_from_page(url, counter):
+def write_dead_letters(filename):
+    '''
+    Append the pages given up on so far to a CSV file, so that they
+    can be retried later, and empty DEAD_LETTERS.
+
+    Inputs:
+      - filename (str): CSV file name
+
+    Returns: None, writes to CSV file
+    '''
+    with open(filename, "a") as f:
+        csvwriter = csv.writer(f)
+        while DEAD_LETTERS:
+            csvwriter.writerow(DEAD_LETTERS.pop(0))
+
+
+def get_links_from_page(url, counter, fetch=read_url):
     '''
     Given a URL, scrape all other URLs that refer to restaurant
     home pages, and convert it to an absolute URL.
@@ -50,40 +183,32 @@ def get_links_from_page(url, counter):
                        before giving up and skipping (higher
                        number corresponds to longer run-time
                        but fewer pages skipped)
+      - fetch (function): function taking a URL and returning HTML
 
     Returns: set of restaurant links from the page
     '''
-    html = read_url(url)
-    soup = bs4.BeautifulSoup(html, "lxml")
-
-    all_tags = try_(counter, True, soup)
+    all_tags = fetch_and_extract(url, counter, True, fetch)
 
     if not all_tags:
         print("Failure at page " + str(url))
         return []
 
     all_links = [tag.get("href") for tag in all_tags]
-    good_links = {convert_if_relative_url(link) for link
+    good_links = {convert_if_relative_url(link, url) for link
                   in all_links if link.startswith("/biz")
                   and "?" not in link}
 
     return good_links
 
 
-def crawl_city(city_url, counter):
+def get_resto_pages(city_url):
     '''
-    Crawl a city and get all the URLs of restaurants within
-    the city.
+    Get the URLs of the pages listing the restaurants in a city.
 
     Inputs:
       - city_url (str): URL of the city's page on Yelp
-      - counter (int): if the program gets blocked by Yelp,
-                       how many times should it try again
-                       before giving up and skipping (higher
-                       number corresponds to longer run-time
-                       but fewer pages skipped)
 
-    Returns: list of restaurant links in city
+    Returns: list of URLs
     '''
     # Yelp displays 240 restaurants for each location
     total_restos = 240
@@ -93,43 +218,92 @@ def crawl_city(city_url, counter):
     for i in range(0, total_restos+1, 10):
         resto_pages.append(city_url + "&start=" + str(i))
 
-    city_restos = []
-    for resto_page in resto_pages:
-        city_restos += get_links_from_page(resto_page, counter)
-        # Random sleep to avoid being banned by Yelp
-        time.sleep(random.randint(3, 5))
+    return resto_pages
 
-    return city_restos
 
+def get_listing_links(city_url, resto_page, counter, fetch=read_url,
+                      state=None):
+    '''
+    Scrape the restaurant links from a page listing the restaurants
+    of a city, skipping pages already recorded in the crawl state and
+    recording new ones.
 
-def get_total_reviews(soup, counter):
+    Inputs:
+      - city_url (str): URL of the city's page on Yelp
+      - resto_page (str): URL of the page listing restaurants
+      - counter (int): if the program gets blocked by Yelp,
+                       how many times should it try again
+                       before giving up and skipping
+      - fetch (function): function taking a URL and returning HTML
+      - state (CrawlState): crawl state, if resuming is enabled
+
+    Returns: list of restaurant links from the page
     '''
-    Given a BeautifulSoup object representing a page, obtain the
-    total number of reviews to help the program determine how many
-    pages of reviews to scrape.
+    if state and state.is_listing_page_done(resto_page):
+        return []
+
+    links = sorted(get_links_from_page(resto_page, counter, fetch))
+    if state and links:
+        state.mark_listing_page_done(city_url, resto_page, links)
+
+    return links
+
+
+def crawl_city(city_url, counter, fetch=read_url, sleep=True, state=None):
+    '''
+    Crawl a city and get all the URLs of restaurants within
+    the city.
 
     Inputs:
-      - soup (BeautifulSoup): soup object
+      - city_url (str): URL of the city's page on Yelp
       - counter (int): if the program gets blocked by Yelp,
                        how many times should it try again
                        before giving up and skipping (higher
                        number corresponds to longer run-time
                        but fewer pages skipped)
+      - fetch (function): function taking a URL and returning HTML
+      - sleep (bool): whether to randomly sleep between pages (not
+                      needed when fetch is already rate limited)
+      - state (CrawlState): crawl state, if resuming is enabled (the
+                            restaurants found by earlier runs are
+                            then also returned, in their saved order)
 
-    Returns: (int) total number reviews for a restaurant
+    Returns: list of restaurant links in city
     '''
-    tag = try_(counter, False, soup)
+    city_restos = []
+    for resto_page in get_resto_pages(city_url):
+        if state and state.is_listing_page_done(resto_page):
+            continue
+        city_restos += get_listing_links(city_url, resto_page, counter,
+                                         fetch, state)
+        if sleep:
+            # Random sleep to avoid being banned by Yelp
+            time.sleep(random.randint(3, 5))
 
-    if not tag:
-        return None
+    if state:
+        return state.get_restaurants(city_url)
 
-    json_object = json.loads(tag.contents[0])
-    total_reviews = json_object["aggregateRating"]["reviewCount"]
+    return city_restos
 
-    return total_reviews
 
+def review_hash(review):
+    '''
+    Identify a review by hashing its rating, date and text.
+
+    Inputs:
+      - review (dict): review from the ld+json object
+
+    Returns: str
+    '''
+    key = json.dumps([review["reviewRating"]["ratingValue"],
+                      review.get("datePublished"),
+                      review["description"]])
 
-def get_reviews_from_page(url, writer, counter):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def get_reviews_from_page(url, writer, counter, fetch=read_url, state=None,
+                          resto_url=None, json_object=None):
     '''
     Given a URL and CSV writer object, write all the reviews
     from a given page to the CSV file.
@@ -142,21 +316,26 @@ def get_reviews_from_page(url, writer, counter):
                        before giving up and skipping (higher
                        number corresponds to longer run-time
                        but fewer pages skipped)
+      - fetch (function): function taking a URL and returning HTML
+      - state (CrawlState): crawl state in which the hashes of the
+                            reviews written are recorded, if given
+      - resto_url (str): URL of the restaurant (needed with state)
+      - json_object (dict): ld+json object of the page, if it was
+                            already fetched (the page is fetched
+                            otherwise)
 
     Returns: (int) number of additional reviews written to CSV
     '''
-    html = read_url(url)
-    soup = bs4.BeautifulSoup(html, "lxml")
-    tag = try_(counter, False, soup)
+    if json_object is None:
+        json_object = fetch_and_extract(url, counter, False, fetch)
     additional_rev = 0
 
-    if not tag:
+    if not json_object:
         print("Failure at page " + str(url))
         return additional_rev
 
     print("Success at page " + str(url))
 
-    json_object = json.loads(tag.contents[0])
     reviews = json_object["review"]
 
     for review in reviews:
@@ -166,10 +345,15 @@ def get_reviews_from_page(url, writer, counter):
         writer.writerow(row)
         additional_rev += 1
 
+    if state:
+        state.add_seen_reviews(resto_url,
+                               [review_hash(review) for review in reviews])
+
     return additional_rev
 
 
-def crawl_resto(url, writer, counter, max_revs_per_resto):
+def crawl_resto(url, writer, counter, max_revs_per_resto, fetch=read_url,
+                sleep=True, state=None):
     '''
     Crawl the restaurant and get all reviews from the restaurant.
 
@@ -186,12 +370,19 @@ def crawl_resto(url, writer, counter, max_revs_per_resto):
                                   (to enable scraping of
                                   a variety of restaurants 
                                   faster)
+      - fetch (function): function taking a URL and returning HTML
+      - sleep (bool): whether to randomly sleep between pages (not
+                      needed when fetch is already rate limited)
+      - state (CrawlState): crawl state, if resuming is enabled (pages
+                            of reviews already written are skipped)
 
     Returns: None, modifies the CSV file in place
     '''
-    html = read_url(url)
-    soup = bs4.BeautifulSoup(html, "lxml")
-    total_reviews = get_total_reviews(soup, counter)
+    # Reviews are read newest first, like refresh_resto reads them
+    first_page = url + NEWEST_FIRST + "0"
+    json_object = fetch_and_extract(first_page, counter, False, fetch)
+    total_reviews = (json_object["aggregateRating"]["reviewCount"]
+                     if json_object else None)
 
     if not total_reviews:
         print("Failure at restaurant " + str(url))
@@ -199,26 +390,278 @@ def crawl_resto(url, writer, counter, max_revs_per_resto):
 
     print("Success at restaurant " + str(url))
 
+    if state:
+        reviews = json_object["review"]
+        state.save_snapshot(url, total_reviews,
+                            review_hash(reviews[0]) if reviews else None)
+
     review_pages = []
 
     # Each page has 20 reviews, so we increment by 20
-    for i in range(0, total_reviews, 20):
-        review_pages.append(url + "?start=" + str(i))
+    for i in range(0, total_reviews, REVIEWS_PER_PAGE):
+        review_pages.append(url + NEWEST_FIRST + str(i))
 
-    total_rev = 0
+    total_rev = state.reviews_scraped(url) if state else 0
+    missed_pages = False
     for review_page in review_pages:
-        rev_count = get_reviews_from_page(review_page, writer, counter)
-        total_rev += rev_count
         if total_rev >= max_revs_per_resto:
             break
-        # Random sleep to avoid being banned by Yelp
-        time.sleep(random.randint(3, 5))
+        if state and state.is_review_page_done(review_page):
+            continue
+        # The first page was already fetched for the review count
+        rev_count = get_reviews_from_page(
+            review_page, writer, counter, fetch, state, url,
+            json_object if review_page == first_page else None)
+        total_rev += rev_count
+        if not rev_count:
+            missed_pages = True
+        elif state:
+            when_written(writer, state.mark_review_page_done, url,
+                         review_page, rev_count)
+        if sleep and total_rev < max_revs_per_resto:
+            # Random sleep to avoid being banned by Yelp
+            time.sleep(random.randint(3, 5))
+
+    # Restaurants with pages that failed are tried again on the next run
+    if state and (total_rev >= max_revs_per_resto or not missed_pages):
+        when_written(writer, state.mark_resto_done, url)
+
+
+def when_written(writer, callback, *args):
+    '''
+    Call a function once the rows given to a writer so far are on disk:
+    right away for (line buffered) CSV files, and once a ReviewWriter
+    has written its buffer to the review dataset. Pages are only marked
+    as done in the crawl state after their reviews are saved.
+
+    Inputs:
+      - writer (csv writer or RestaurantWriter): writer object
+      - callback (function): function to call
+      - args: arguments of the function
+    '''
+    if hasattr(writer, "after_flush"):
+        writer.after_flush(callback, *args)
+    else:
+        callback(*args)
+
+
+def scrape_resto(url, filename, counter, max_revs_per_resto,
+                 fetch=read_url, sleep=True, state=None, store=None):
+    '''
+    Crawl a restaurant and write its reviews to their own CSV file.
+
+    Inputs:
+      - url (str): URL
+      - filename (str): CSV file name
+      - counter (int): if the program gets blocked by Yelp,
+                       how many times should it try again
+                       before giving up and skipping
+      - max_revs_per_resto (int): max number of reviews
+                                  scraped per restaurant
+      - fetch (function): function taking a URL and returning HTML
+      - sleep (bool): whether to randomly sleep between pages
+      - state (CrawlState): crawl state, if resuming is enabled (reviews
+                            already written are then kept and appended
+                            to instead of being overwritten)
+      - store (ReviewWriter): if given, reviews are appended to the
+                              review dataset through this writer of
+                              the city instead of the CSV file, under
+                              the restaurant index named by filename
+                              (<city>/<index>.csv)
+
+    Returns: None, writes a CSV file
+    '''
+    if state and state.is_resto_done(url):
+        return
+
+    if store:
+        restaurant = int(os.path.splitext(os.path.basename(filename))[0])
+        first_review = state.reviews_scraped(url) if state else 0
+        crawl_resto(url, store.restaurant(restaurant, first_review), counter,
+                    max_revs_per_resto, fetch, sleep, state)
+        return
+
+    mode = "a" if state and state.reviews_scraped(url) else "w"
+    # Line buffered, so that no review recorded in state is left unwritten
+    with open(filename, mode, buffering=1) as f:
+        csvwriter = csv.writer(f)
+        crawl_resto(url, csvwriter, counter, max_revs_per_resto, fetch,
+                    sleep, state)
+
+
+def refresh_resto(url, writer, counter, max_new_revs, state, fetch=read_url,
+                  sleep=True):
+    '''
+    Write only the reviews of a restaurant that were posted since it
+    was last scraped. Restaurants whose review count has not changed
+    are skipped after one page, and otherwise pages of reviews are
+    read newest first until reaching a review that was already seen,
+    or as many reviews as the review count grew by.
+
+    Inputs:
+      - url (str): URL of the restaurant
+      - writer (csv writer): writer object
+      - counter (int): if the program gets blocked by Yelp,
+                       how many times should it try again
+                       before giving up and skipping
+      - max_new_revs (int): max number of new reviews scraped
+      - state (CrawlState): crawl state holding what was seen before
+      - fetch (function): function taking a URL and returning HTML
+      - sleep (bool): whether to randomly sleep between pages
+
+    Returns: (int) number of new reviews written to CSV, None if the
+             restaurant could not be scraped
+    '''
+    old_count, newest_review = state.get_snapshot(url)
+    seen_reviews = state.get_seen_reviews(url)
+    if newest_review:
+        seen_reviews.add(newest_review)
+
+    new_revs = []
+    for start in itertools.count(0, REVIEWS_PER_PAGE):
+        json_object = fetch_and_extract(url + NEWEST_FIRST + str(start),
+                                        counter, False, fetch)
+        if not json_object:
+            print("Failure at restaurant " + str(url))
+            return None
+
+        reviews = json_object["review"]
+        if start == 0:
+            review_count = json_object["aggregateRating"]["reviewCount"]
+            if review_count == old_count:
+                print("No new reviews at restaurant " + str(url))
+                return 0
+            if old_count is not None:
+                # Never more new reviews than the count grew by
+                max_new_revs = min(max_new_revs,
+                                   max(review_count - old_count, 0))
+            if reviews:
+                newest_review = review_hash(reviews[0])
+
+        reached_seen = False
+        for review in reviews:
+            if review_hash(review) in seen_reviews:
+                reached_seen = True
+                break
+            new_revs.append(review)
+
+        if (reached_seen or not reviews or len(new_revs) >= max_new_revs
+                or start + REVIEWS_PER_PAGE >= review_count):
+            break
+        if sleep:
+            # Random sleep to avoid being banned by Yelp
+            time.sleep(random.randint(3, 5))
+
+    new_revs = new_revs[:max_new_revs]
+    for review in new_revs:
+        writer.writerow([review["reviewRating"]["ratingValue"],
+                         review["description"]])
+    state.add_seen_reviews(url, [review_hash(review) for review in new_revs])
+    state.save_snapshot(url, review_count, newest_review)
+    print("{} new reviews at restaurant {}".format(len(new_revs), url))
+
+    return len(new_revs)
+
+
+def refresh_city(city_url, csv_repo, state_file, counter=30,
+                 max_new_revs=100, requests_per_second=1.0, burst=5):
+    '''
+    Incrementally re-scrape the restaurants of a city found by an
+    earlier crawl_and_scrape (run with the same state_file), appending
+    only their new reviews to their CSV files. The cost of a refresh
+    therefore scales with the number of new reviews, not the total.
+    Instead of sleeping after every restaurant, requests are paced by
+    a token bucket, so that runs of unchanged restaurants (one page
+    each) are not slowed down more than needed.
+
+    Inputs:
+      - city_url (str): Yelp URL of the city
+      - csv_repo (str): name of repository in which scraped data
+                        is stored
+      - state_file (str): SQLite file recording the crawl state
+      - counter (int): if the program gets blocked by Yelp,
+                       how many times should it try again
+                       before giving up and skipping
+      - max_new_revs (int): max number of new reviews scraped per
+                            restaurant
+      - requests_per_second (float): average request rate
+      - burst (int): number of requests allowed back to back
+
+    Returns: (int) number of new reviews written, appends to CSV files
+    '''
+    state = CrawlState(state_file)
+    fetch = PoliteFetcher(requests_per_second, burst, per_host=1)
+    total_new = 0
+
+    for i, resto in enumerate(state.get_restaurants(city_url)):
+        with open(csv_repo + str(i) + ".csv", "a", buffering=1) as f:
+            csvwriter = csv.writer(f)
+            total_new += refresh_resto(resto, csvwriter, counter,
+                                       max_new_revs, state, fetch,
+                                       sleep=False) or 0
+
+    return total_new
+
+
+def read_url_politely(url):
+    '''
+    Randomly sleep (to avoid being banned by Yelp), then load HTML
+    from URL. Used behind the HTML cache, so that pages replayed from
+    disk are not slowed down.
+
+    Inputs:
+      - url (str): URL
+
+    Returns: bytes
+    '''
+    time.sleep(random.randint(3, 5))
+
+    return read_url(url)
+
+
+def open_store(store_dir, csv_repo):
+    '''
+    Open one writer to the review dataset for the whole city, so that
+    reviews from many restaurants are written together.
+
+    Inputs:
+      - store_dir (str): directory of the review dataset (None if
+                         reviews are written to CSV files)
+      - csv_repo (str): name of repository naming the city
+
+    Returns: ReviewWriter, or an empty context if store_dir is None
+    '''
+    if not store_dir:
+        return contextlib.nullcontext()
+
+    # pyarrow is only needed when writing to the review dataset
+    from review_store import ReviewWriter
+
+    return ReviewWriter(store_dir, os.path.basename(os.path.dirname(csv_repo)))
+
+
+def open_cache(cache_dir, fetch):
+    '''
+    Open the HTML cache, keeping block pages out of it.
+
+    Inputs:
+      - cache_dir (str): directory in which pages are cached
+      - fetch (function): function taking a URL and returning HTML
+
+    Returns: HtmlCache
+    '''
+    return HtmlCache(cache_dir, fetch,
+                     validate=lambda html: not is_blocked(html))
 
 
 def crawl_and_scrape(city_url,
                      csv_repo,
                      counter=30,
-                     max_revs_per_resto=20):
+                     max_revs_per_resto=20,
+                     dead_letter_file=None,
+                     state_file=None,
+                     cache_dir=None,
+                     store_dir=None):
     '''
     Crawl a given city landing page according to the provided URL (e.g.
     https://www.yelp.com/search?cflt=restaurants&find_loc=Chicago%2C%20IL)
@@ -239,20 +682,127 @@ def crawl_and_scrape(city_url,
                                   (to enable scraping of
                                   a variety of restaurants 
                                   faster)
+      - dead_letter_file (str): CSV file to which pages given up on
+                                are appended, if given
+      - state_file (str): SQLite file recording the progress of the
+                          crawl, so that it can be resumed if it dies
+                          (should not be inside csv_repo)
+      - cache_dir (str): directory in which fetched pages are cached
+                         and replayed from on later runs (should not
+                         be inside csv_repo)
+      - store_dir (str): if given, reviews are appended to the review
+                         dataset in this directory (see review_store.py)
+                         instead of CSV files, with csv_repo naming
+                         the city
 
     Returns: None, writes a CSV file
     '''
-    city_restos = crawl_city(city_url, counter)
-    if not city_restos:
-        return "Failed to scrape restaurant links, try a higher counter"
-    print(("Successfully generated list of "
-           "{} restaurant links").format(len(city_restos)))
-    print(city_restos)
+    state = CrawlState(state_file) if state_file else None
+    fetch = read_url
+    sleep = True
+    if cache_dir:
+        fetch = open_cache(cache_dir, read_url_politely)
+        sleep = False
+
+    # Pages given up on are saved however the crawl ends
+    try:
+        city_restos = crawl_city(city_url, counter, fetch, sleep, state)
+        if not city_restos:
+            return "Failed to scrape restaurant links, try a higher counter"
+        print(("Successfully generated list of "
+               "{} restaurant links").format(len(city_restos)))
+        print(city_restos)
+
+        with open_store(store_dir, csv_repo) as store:
+            for i, resto in enumerate(city_restos):
+                filename = csv_repo + str(i) + ".csv"
+                if state and state.is_resto_done(resto):
+                    continue
+                scrape_resto(resto, filename, counter, max_revs_per_resto,
+                             fetch, sleep, state, store)
+                if sleep:
+                    # Random sleep to avoid being banned by Yelp
+                    time.sleep(random.randint(3, 5))
+    finally:
+        if dead_letter_file:
+            write_dead_letters(dead_letter_file)
+
+
+def crawl_and_scrape_concurrent(city_url,
+                                csv_repo,
+                                counter=30,
+                                max_revs_per_resto=20,
+                                max_workers=8,
+                                requests_per_second=1.0,
+                                per_host=4,
+                                fetch=read_url,
+                                dead_letter_file=None,
+                                state_file=None,
+                                cache_dir=None,
+                                store_dir=None):
+    '''
+    Same as crawl_and_scrape, but restaurants (and the pages listing
+    them) are crawled by a pool of threads, so that waiting for one
+    page overlaps with waiting for others. Instead of random sleeps,
+    politeness is guaranteed by sharing one rate limit between all
+    threads and capping the number of requests in flight per host.
 
-    for i, resto in enumerate(city_restos):
-        filename = csv_repo + str(i) + ".csv"
-        with open(filename, "w") as f:
-            csvwriter = csv.writer(f)
-            crawl_resto(resto, csvwriter, counter, max_revs_per_resto)
-            # Random sleep to avoid being banned by Yelp
-            time.sleep(random.randint(3, 5))
+    Inputs:
+      - city_url (str): Yelp URL of the city
+      - csv_repo (str): name of repository in which to store
+                        scraped data
+      - counter (int): if the program gets blocked by Yelp,
+                       how many times should it try again
+                       before giving up and skipping
+      - max_revs_per_resto (int): max number of reviews
+                                  scraped per restaurant
+      - max_workers (int): number of threads crawling at once
+      - requests_per_second (float): request rate shared by all threads
+      - per_host (int): maximum concurrent requests per host
+      - fetch (function): function taking a URL and returning HTML
+      - dead_letter_file (str): CSV file to which pages given up on
+                                are appended, if given
+      - state_file (str): SQLite file recording the progress of the
+                          crawl, so that it can be resumed if it dies
+      - cache_dir (str): directory in which fetched pages are cached
+                         and replayed from on later runs
+      - store_dir (str): if given, reviews are appended to the review
+                         dataset in this directory instead of CSV files
+
+    Returns: None, writes CSV files
+    '''
+    state = CrawlState(state_file) if state_file else None
+    polite_fetch = PoliteFetcher(requests_per_second, per_host=per_host,
+                                 fetch=fetch)
+    if cache_dir:
+        # Pages replayed from the cache do not count towards the rate limit
+        polite_fetch = open_cache(cache_dir, polite_fetch)
+
+    # Pages given up on are saved however the crawl ends
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            page_links = executor.map(
+                lambda page: get_listing_links(city_url, page, counter,
+                                               polite_fetch, state),
+                get_resto_pages(city_url))
+            city_restos = [link for links in page_links for link in links]
+            if state:
+                city_restos = state.get_restaurants(city_url)
+
+            if not city_restos:
+                return ("Failed to scrape restaurant links, "
+                        "try a higher counter")
+            print(("Successfully generated list of "
+                   "{} restaurant links").format(len(city_restos)))
+
+            with open_store(store_dir, csv_repo) as store:
+                futures = [executor.submit(scrape_resto, resto,
+                                           csv_repo + str(i) + ".csv",
+                                           counter, max_revs_per_resto,
+                                           polite_fetch, False, state, store)
+                           for i, resto in enumerate(city_restos)]
+                for future in futures:
+                    future.result()
+    finally:
+        if dead_letter_file:
+            write_dead_letters(dead_letter_file)
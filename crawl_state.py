@@ -0,0 +1,368 @@
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import threading
+from util import read_url
+
+
+class CrawlState:
+    '''
+    Persistent record of how far a crawl has got, kept in a SQLite
+    database: which pages listing restaurants have been crawled, which
+    restaurants were found (and the index of their CSV file), which
+    pages of reviews have been written and which restaurants are done.
+    A crawl that dies halfway through can then be resumed where it
+    stopped instead of starting again from crawl_city.
+
+    For incremental re-scrapes, it also remembers the last review count
+    and newest review of each restaurant, and a hash of every review
+    written, so that only new reviews are fetched.
+    '''
+
+    def __init__(self, db_file):
+        '''
+        Open (or create) the crawl state database.
+
+        Inputs:
+          - db_file (str): SQLite database file name
+        '''
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS listing_pages (
+                    url TEXT PRIMARY KEY,
+                    city_url TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS restaurants (
+                    url TEXT PRIMARY KEY,
+                    city_url TEXT NOT NULL,
+                    resto_index INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS review_pages (
+                    url TEXT PRIMARY KEY,
+                    resto_url TEXT NOT NULL,
+                    num_reviews INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS review_pages_resto
+                    ON review_pages (resto_url);
+                CREATE TABLE IF NOT EXISTS resto_snapshots (
+                    url TEXT PRIMARY KEY,
+                    review_count INTEGER,
+                    newest_review TEXT);
+                CREATE TABLE IF NOT EXISTS seen_reviews (
+                    resto_url TEXT NOT NULL,
+                    review_hash TEXT NOT NULL,
+                    PRIMARY KEY (resto_url, review_hash)) WITHOUT ROWID;
+            ''')
+
+    def query(self, sql, params=()):
+        '''
+        Run a query and fetch all of its rows.
+
+        Inputs:
+          - sql (str): SQL query
+          - params (tuple): query parameters
+
+        Returns: list of tuples
+        '''
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def is_listing_page_done(self, url):
+        '''
+        Determine if the restaurant links of a listing page were saved.
+
+        Inputs:
+          - url (str): URL of the page listing restaurants
+
+        Returns: Bool
+        '''
+        return bool(self.query("SELECT 1 FROM listing_pages WHERE url = ?",
+                               (url,)))
+
+    def mark_listing_page_done(self, city_url, url, links):
+        '''
+        Save the restaurant links found on a listing page, giving each
+        new restaurant the next free index in its city.
+
+        Inputs:
+          - city_url (str): URL of the city's page on Yelp
+          - url (str): URL of the page listing restaurants
+          - links (list of str): restaurant links found on the page
+        '''
+        with self.lock, self.conn:
+            for link in links:
+                next_index = self.conn.execute(
+                    "SELECT COUNT(*) FROM restaurants WHERE city_url = ?",
+                    (city_url,)).fetchone()[0]
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO restaurants "
+                    "(url, city_url, resto_index) VALUES (?, ?, ?)",
+                    (link, city_url, next_index))
+            self.conn.execute(
+                "INSERT OR IGNORE INTO listing_pages VALUES (?, ?)",
+                (url, city_url))
+
+    def get_restaurants(self, city_url):
+        '''
+        Get the restaurants found so far in a city, ordered by index.
+
+        Inputs:
+          - city_url (str): URL of the city's page on Yelp
+
+        Returns: list of str
+        '''
+        rows = self.query("SELECT url FROM restaurants WHERE city_url = ? "
+                          "ORDER BY resto_index", (city_url,))
+
+        return [url for url, in rows]
+
+    def is_resto_done(self, url):
+        '''
+        Determine if all the reviews wanted from a restaurant were saved.
+
+        Inputs:
+          - url (str): URL of the restaurant
+
+        Returns: Bool
+        '''
+        return bool(self.query("SELECT 1 FROM restaurants "
+                               "WHERE url = ? AND done = 1", (url,)))
+
+    def mark_resto_done(self, url):
+        '''
+        Record that all the reviews wanted from a restaurant were saved.
+
+        Inputs:
+          - url (str): URL of the restaurant
+        '''
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE restaurants SET done = 1 "
+                              "WHERE url = ?", (url,))
+
+    def is_review_page_done(self, url):
+        '''
+        Determine if the reviews of a page were saved.
+
+        Inputs:
+          - url (str): URL of the page of reviews
+
+        Returns: Bool
+        '''
+        return bool(self.query("SELECT 1 FROM review_pages WHERE url = ?",
+                               (url,)))
+
+    def mark_review_page_done(self, resto_url, url, num_reviews):
+        '''
+        Record that the reviews of a page were saved.
+
+        Inputs:
+          - resto_url (str): URL of the restaurant
+          - url (str): URL of the page of reviews
+          - num_reviews (int): number of reviews saved from the page
+        '''
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO review_pages VALUES (?, ?, ?)",
+                (url, resto_url, num_reviews))
+
+    def reviews_scraped(self, resto_url):
+        '''
+        Count the reviews saved so far from a restaurant.
+
+        Inputs:
+          - resto_url (str): URL of the restaurant
+
+        Returns: int
+        '''
+        rows = self.query("SELECT COALESCE(SUM(num_reviews), 0) "
+                          "FROM review_pages WHERE resto_url = ?",
+                          (resto_url,))
+
+        return rows[0][0]
+
+    def get_snapshot(self, url):
+        '''
+        Get the review count and newest review of a restaurant the last
+        time it was scraped.
+
+        Inputs:
+          - url (str): URL of the restaurant
+
+        Returns: int (review count) and str (hash of the newest review),
+                 both None if unknown
+        '''
+        rows = self.query("SELECT review_count, newest_review "
+                          "FROM resto_snapshots WHERE url = ?", (url,))
+
+        return rows[0] if rows else (None, None)
+
+    def save_snapshot(self, url, review_count, newest_review=None):
+        '''
+        Record the review count and newest review of a restaurant.
+
+        Inputs:
+          - url (str): URL of the restaurant
+          - review_count (int): total number of reviews on Yelp
+          - newest_review (str): hash of the newest review, the saved
+                                 one is kept if not given
+        '''
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO resto_snapshots VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET "
+                "review_count = excluded.review_count, "
+                "newest_review = COALESCE(excluded.newest_review, "
+                "newest_review)",
+                (url, review_count, newest_review))
+
+    def get_seen_reviews(self, resto_url):
+        '''
+        Get the hashes of the reviews written so far for a restaurant.
+
+        Inputs:
+          - resto_url (str): URL of the restaurant
+
+        Returns: set of str
+        '''
+        rows = self.query("SELECT review_hash FROM seen_reviews "
+                          "WHERE resto_url = ?", (resto_url,))
+
+        return {review_hash for review_hash, in rows}
+
+    def add_seen_reviews(self, resto_url, review_hashes):
+        '''
+        Record the hashes of reviews written for a restaurant.
+
+        Inputs:
+          - resto_url (str): URL of the restaurant
+          - review_hashes (list of str): hashes of the reviews
+        '''
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_reviews VALUES (?, ?)",
+                [(resto_url, review_hash) for review_hash in review_hashes])
+
+
+class HtmlCache:
+    '''
+    Content-addressed cache of fetched pages. Each distinct page is
+    stored once, gzip-compressed, under the SHA-256 hash of its HTML,
+    and a SQLite index maps URLs to these hashes. Used in place of a
+    fetch function, it replays pages from disk instead of the network
+    so that reruns and parser changes do not download pages again.
+    '''
+
+    def __init__(self, directory, fetch=read_url, validate=None):
+        '''
+        Open (or create) the cache.
+
+        Inputs:
+          - directory (str): directory in which pages are stored
+          - fetch (function): function taking a URL and returning HTML,
+                              used for pages missing from the cache
+          - validate (function): function taking HTML and returning
+                                 whether the page is worth caching
+                                 (e.g. it is not a block page)
+        '''
+        self.directory = directory
+        self.fetch = fetch
+        self.validate = validate
+        self.served = set()
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, "index.sqlite"),
+                                    check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    fetched_at REAL NOT NULL)''')
+
+    def path(self, digest):
+        '''
+        Get the file name under which a page is stored.
+
+        Inputs:
+          - digest (str): SHA-256 hash of the page
+
+        Returns: str
+        '''
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".gz")
+
+    def get(self, url):
+        '''
+        Load a page from the cache.
+
+        Inputs:
+          - url (str): URL
+
+        Returns: bytes if cached, None otherwise
+        '''
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM pages WHERE url = ?",
+                                    (url,)).fetchone()
+        if row is None or not os.path.exists(self.path(row[0])):
+            return None
+
+        with gzip.open(self.path(row[0]), "rb") as f:
+            return f.read()
+
+    def put(self, url, html):
+        '''
+        Store a page in the cache.
+
+        Inputs:
+          - url (str): URL
+          - html (bytes or str): HTML of the page
+
+        Returns: str (SHA-256 hash of the page)
+        '''
+        if isinstance(html, str):
+            html = html.encode("utf-8")
+
+        digest = hashlib.sha256(html).hexdigest()
+        path = self.path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(html)
+            os.replace(tmp_path, path)
+
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                              (url, digest, time.time()))
+
+        return digest
+
+    def __call__(self, url):
+        '''
+        Load HTML from URL, from the cache if possible. A URL requested
+        again by the same crawl (i.e. a retry because the cached copy
+        turned out to be unusable) is always fetched from the network.
+
+        Inputs:
+          - url (str): URL
+
+        Returns: bytes
+        '''
+        with self.lock:
+            first_request = url not in self.served
+            self.served.add(url)
+
+        if first_request:
+            html = self.get(url)
+            if html is not None:
+                return html
+
+        html = self.fetch(url)
+        if html and (self.validate is None or self.validate(html)):
+            self.put(url, html)
+
+        return html
@@ -1,13 +1,63 @@
 import sys
-import joblib
-import pandas as pd
-import numpy as np
-from sklearn import linear_model
-from textblob import TextBlob
+import time
+import codecs
+import argparse
+import threading
+from predictor import RatingPredictor
 
 
-def user_interface():
-    '''Prompt user to input a review, and suggest a star rating.'''
+MIN_REVIEW_LENGTH = 50
+READ_SIZE = 2 ** 16  # Characters read at a time in pipe mode
+
+
+def load_in_background(autocorrect=True):
+    '''
+    Start loading the PKL files (and the libraries needed to unpickle
+    them) in a background thread, so that the prompt appears right away
+    and the user types their review while the model loads.
+
+    Inputs:
+      - autocorrect (bool): whether to fix spelling errors in reviews
+
+    Returns: function returning the RatingPredictor, waiting for it to
+             finish loading if needed
+    '''
+    result = {}
+
+    def load():
+        try:
+            result["predictor"] = RatingPredictor(autocorrect=autocorrect)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+
+    def get_predictor():
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["predictor"]
+
+    return get_predictor
+
+
+def user_interface(predictor=None, autocorrect=True):
+    '''
+    Prompt user to input a review, and suggest a star rating.
+
+    Inputs:
+      - predictor (RatingPredictor): preloaded predictor, loaded from
+                                     the PKL files in the background
+                                     if not given
+      - autocorrect (bool): whether to fix spelling errors in reviews
+                            (if the predictor is loaded here)
+    '''
+    if predictor is None:
+        get_predictor = load_in_background(autocorrect)
+    else:
+        get_predictor = lambda: predictor
+
     print("==================================================")
     print("   Welcome to the Suggested Star Rating System!")
     print()
@@ -20,16 +70,12 @@ def user_interface():
         while True:
             review = input("Enter review here: ")
             review = str(review)
-            if len(review) >= 50:
+            if len(review) >= MIN_REVIEW_LENGTH:
                 break
             else:
                 print("Please input a longer review.")
 
-        x_array = process_input(review)
-
-        final_model = joblib.load("optimal_args/final_model.pkl")
-        prediction = final_model.predict(x_array)
-        star_rating = int(prediction)
+        star_rating = get_predictor().predict(review)
 
         print(" ")
         print("Your suggested star rating is: {}".format(star_rating))
@@ -39,27 +85,236 @@ def user_interface():
         sys.exit()
 
 
-def process_input(review):
+def timed_predict(predictor, review):
+    '''
+    Suggest a star rating for a review and measure how long it took.
+
+    Inputs:
+      - predictor (RatingPredictor): preloaded predictor
+      - review (str): review text
+
+    Returns: int (star rating), float (milliseconds)
+    '''
+    start = time.perf_counter()
+    star_rating = predictor.predict(review)
+
+    return star_rating, (time.perf_counter() - start) * 1000
+
+
+def print_latency_summary(latencies):
+    '''
+    Print the number of reviews scored and their mean, median and 99th
+    percentile latency to stderr.
+
+    Inputs:
+      - latencies (list of float): milliseconds per review
+    '''
+    if not latencies:
+        return
+
+    latencies = sorted(latencies)
+    print("Scored {} reviews | mean {:.2f} ms | p50 {:.2f} ms | "
+          "p99 {:.2f} ms".format(
+              len(latencies), sum(latencies) / len(latencies),
+              latencies[len(latencies) // 2],
+              latencies[min(len(latencies) - 1,
+                            int(len(latencies) * 0.99))]),
+          file=sys.stderr)
+
+
+def repl(predictor=None, timing=False, autocorrect=True):
+    '''
+    Prompt the user for reviews and suggest a star rating for each of
+    them, until the user exits with Control-D. The model is only loaded
+    once for the whole session.
+
+    Inputs:
+      - predictor (RatingPredictor): preloaded predictor, loaded from
+                                     the PKL files in the background
+                                     if not given
+      - timing (bool): whether to print the time taken by each review
+      - autocorrect (bool): whether to fix spelling errors in reviews
+                            (if the predictor is loaded here)
+    '''
+    if predictor is None:
+        get_predictor = load_in_background(autocorrect)
+    else:
+        get_predictor = lambda: predictor
+
+    print("==================================================")
+    print("   Welcome to the Suggested Star Rating System!")
+    print()
+    print("    Copy and paste or type in your reviews, one")
+    print("       per line. Type Control-D to exit.")
+    print("==================================================")
+    print()
+    latencies = []
+    try:
+        while True:
+            review = input("Enter review here: ")
+            if len(review) < MIN_REVIEW_LENGTH:
+                print("Please input a longer review.")
+                continue
+
+            star_rating, latency = timed_predict(get_predictor(), review)
+            latencies.append(latency)
+            print("Your suggested star rating is: {}".format(star_rating))
+            if timing:
+                print("Scored in {:.2f} ms".format(latency))
+            print()
+    except EOFError:
+        print()
+        if timing:
+            print_latency_summary(latencies)
+        print("Thank you for using our Suggested Star Rating System!")
+
+
+def read_available(stream):
+    '''
+    Read a text stream as the data arrives. read() on a text stream
+    waits until READ_SIZE characters are read, so the bytes available
+    in its binary buffer are read and decoded instead (if it has one).
+
+    Inputs:
+      - stream (file): text stream (e.g. sys.stdin)
+
+    Returns: generator of str
+    '''
+    buffer = getattr(stream, "buffer", None)
+    if not hasattr(buffer, "read1"):
+        yield from iter(lambda: stream.read(READ_SIZE), "")
+        return
+
+    decoder = codecs.getincrementaldecoder(stream.encoding or "utf-8")(
+        stream.errors or "strict")
+    while True:
+        data = buffer.read1(READ_SIZE)
+        # Characters split between two reads are completed on the next
+        yield decoder.decode(data, final=not data)
+        if not data:
+            return
+
+
+def read_reviews(stream, delimiter="\n"):
+    '''
+    Read reviews separated by a delimiter from a text stream, yielding
+    each one as soon as it is complete. Empty reviews are yielded too,
+    so that outputs can be matched to inputs by position.
+
+    Inputs:
+      - stream (file): text stream (e.g. sys.stdin)
+      - delimiter (str): "\n" for one review per line or "\0" for
+                         NUL-separated reviews (which may contain
+                         newlines)
+
+    Returns: generator of str
+    '''
+    if delimiter == "\n":
+        for line in stream:
+            yield line.rstrip("\r\n")
+        return
+
+    pending = ""
+    for chunk in read_available(stream):
+        *reviews, pending = (pending + chunk).split(delimiter)
+        yield from reviews
+
+    # Nothing follows a trailing delimiter
+    if pending:
+        yield pending
+
+
+def score_stream(stream, predictor, delimiter="\n", timing=False,
+                 out=None):
+    '''
+    Suggest a star rating for each review read from a stream, printing
+    one rating per line as soon as each review is scored. Blank reviews
+    are not scored, but get an empty line, so that line N of the output
+    is always the rating of review N.
+
+    Inputs:
+      - stream (file): text stream of reviews
+      - predictor (RatingPredictor): preloaded predictor
+      - delimiter (str): "\n" or "\0" (see read_reviews)
+      - timing (bool): whether to print the time taken by each review
+                       next to its rating (tab separated), and a
+                       summary to stderr at the end
+      - out (file): stream to which the ratings are written (stdout
+                    if None)
+
+    Returns: int (number of reviews scored)
+    '''
+    if out is None:
+        out = sys.stdout
+
+    latencies = []
+    for review in read_reviews(stream, delimiter):
+        if not review.strip():
+            print(file=out, flush=True)
+            continue
+        star_rating, latency = timed_predict(predictor, review)
+        latencies.append(latency)
+        if timing:
+            print("{}\t{:.2f}".format(star_rating, latency), file=out,
+                  flush=True)
+        else:
+            print(star_rating, file=out, flush=True)
+
+    if timing:
+        print_latency_summary(latencies)
+
+    return len(latencies)
+
+
+def process_input(review, predictor=None):
     '''
     Autocorrects user input and converts it into a tfidf array
     using the saved vectorizer and selector PKL files.
 
     Inputs:
       - review (str): review input by user
+      - predictor (RatingPredictor): preloaded predictor, created
+                                     from the PKL files if not given
 
     Returns: arr
     '''
-    vectorizer = joblib.load("optimal_args/vectorizer.pkl")
-    selector = joblib.load("optimal_args/selector.pkl")
+    if predictor is None:
+        predictor = RatingPredictor()
 
-    # Fix spelling errors
-    textBlb = TextBlob(review)
-    corrected_review = str(textBlb.correct())
+    return predictor.transform([review])
 
-    x_array = selector.transform(vectorizer.transform([corrected_review]))
 
-    return x_array
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Suggest star ratings for Yelp reviews. Prompts for "
+                    "a single review by default.")
+    parser.add_argument("--repl", action="store_true",
+                        help="keep prompting for reviews until Control-D")
+    parser.add_argument("--file", default=None,
+                        help="score the reviews in a file, one per line "
+                             "('-' for stdin, the default when stdin is "
+                             "not a terminal)")
+    parser.add_argument("-0", "--null", action="store_true",
+                        help="reviews are separated by NUL characters "
+                             "instead of newlines")
+    parser.add_argument("--timing", action="store_true",
+                        help="print the time taken by each review")
+    parser.add_argument("--no-autocorrect", action="store_true",
+                        help="do not fix spelling errors before scoring")
+    args = parser.parse_args()
 
+    if args.file is None and not sys.stdin.isatty() and not args.repl:
+        args.file = "-"
 
-if __name__ == "__main__":
-    user_interface()
+    if args.file is not None:
+        predictor = RatingPredictor(autocorrect=not args.no_autocorrect)
+        delimiter = "\0" if args.null else "\n"
+        if args.file == "-":
+            score_stream(sys.stdin, predictor, delimiter, args.timing)
+        else:
+            with open(args.file, newline="") as f:
+                score_stream(f, predictor, delimiter, args.timing)
+    elif args.repl:
+        repl(timing=args.timing, autocorrect=not args.no_autocorrect)
+    else:
+        user_interface(autocorrect=not args.no_autocorrect)
@@ -1,58 +1,312 @@
 import os
 import csv
+import time
 import pandas as pd
 import numpy as np
 import glob
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # Fall back to pandas' CSV reader
+    pa_csv = None
 
 RANDOM_SEED = 33
+RATINGS = range(1, 6)  # There is 5 rating groups
+CSV_DTYPES = {"Rating": "uint8", "Text": "string"}
 
 
-def merge_data(out_csv="test_data/merged_data.csv",
-               scraped_data_dir="scraped_data/", num_samples=10000):
+def list_scraped_data(scraped_data_dir="scraped_data/"):
     '''
-    First, combine all restaurant reviews into one dataframe.
-    Then, try to generate a roughly equal distribution of reviews
-    in terms of rating. Finally, write merged dataset into a CSV.
+    Get a list of all CSV filenames in scraped data directories.
 
     Input:
-      - out_csv (str): csv file name for the merged dataset
       - scraped_data_dir (str): name of directory containing food reviews from 
                                 restaurants in different cities
-      - num_samples (int): total number of reviews selected for merged dataset
 
-    Returns: None, writes to CSV file
+    Returns: list of (city, filename) tuples
     '''
-    # Get a list of all CSV filenames in scraped data directories
     all_rest_csv = []
 
     for directory in os.listdir(scraped_data_dir):
         for file_name in os.listdir(scraped_data_dir+str(directory)):
-            all_rest_csv += [scraped_data_dir +
-                             str(directory)+'/'+str(file_name)]
+            all_rest_csv += [(str(directory), scraped_data_dir +
+                              str(directory)+'/'+str(file_name))]
+
+    return all_rest_csv
+
+
+def read_restaurant_csv(file_name):
+    '''
+    Read the reviews of one restaurant from its headerless CSV file,
+    with Rating as uint8 and Text as string. Uses pyarrow's CSV reader
+    if it is installed.
+
+    Input:
+      - file_name (str): CSV file name
+
+    Returns: DataFrame
+    '''
+    if os.path.getsize(file_name) == 0:
+        return pd.DataFrame({"Rating": [], "Text": []}).astype(CSV_DTYPES)
+
+    if pa_csv is None:
+        return pd.read_csv(file_name, usecols=[0, 1], names=["Rating", "Text"],
+                           header=None, dtype=CSV_DTYPES)
+
+    table = pa_csv.read_csv(
+        file_name,
+        read_options=pa_csv.ReadOptions(autogenerate_column_names=True),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["f0", "f1"],
+            column_types={"f0": pa.uint8(), "f1": pa.string()},
+            strings_can_be_null=True))
+    df = table.rename_columns(["Rating", "Text"]).to_pandas()
+
+    return df.astype(CSV_DTYPES)
+
+
+def iter_scraped_data(scraped_data_dir="scraped_data/"):
+    '''
+    Read the restaurant reviews in the scraped data directories one
+    restaurant CSV at a time.
+
+    Input:
+      - scraped_data_dir (str): name of directory containing food reviews from 
+                                restaurants in different cities
+
+    Returns: generator of DataFrames
+    '''
+    return (read_restaurant_csv(f)
+            for _, f in list_scraped_data(scraped_data_dir))
+
+
+def read_scraped_data(scraped_data_dir="scraped_data/", max_workers=16):
+    '''
+    Combine all restaurant reviews in the scraped data directories
+    into one dataframe. The CSV files are read by a pool of threads,
+    so that waiting to open one file overlaps with reading others,
+    and the number of reviews per city and the throughput are printed.
+
+    Input:
+      - scraped_data_dir (str): name of directory containing food reviews from 
+                                restaurants in different cities
+      - max_workers (int): number of threads reading files at once
+
+    Returns: DataFrame
+    '''
+    start = time.perf_counter()
+    all_rest_csv = list_scraped_data(scraped_data_dir)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        df_from_each_file = list(executor.map(
+            read_restaurant_csv, [f for _, f in all_rest_csv]))
+
+    city_counts = {}
+    for (city, _), df in zip(all_rest_csv, df_from_each_file):
+        city_counts[city] = city_counts.get(city, 0) + len(df)
 
     # Concatenate all DataFrames together
-    df_from_each_file = (pd.read_csv(f, usecols=[0, 1],
-                                     names=["Rating", "Text"],
-                                     header=None)
-                         for f in all_rest_csv)
     concatenated_df = pd.concat(df_from_each_file, ignore_index=True)
 
-    # Removing duplicates if present
-    concatenated_df = concatenated_df.drop_duplicates().reset_index(drop=True)
+    elapsed = time.perf_counter() - start
+    for city, count in sorted(city_counts.items()):
+        print("{}: {} reviews".format(city, count))
+    print("Read {} reviews from {} files in {:.2f}s ({:.0f} files/s)".format(
+        len(concatenated_df), len(all_rest_csv), elapsed,
+        len(all_rest_csv) / elapsed if elapsed else 0))
 
-    # Try to achieve the most equal distribution of reviews by rating
+    return concatenated_df
+
+
+def drop_duplicate_reviews(df):
+    '''
+    Remove duplicate reviews, comparing a 64-bit hash of each review
+    instead of its full text.
+
+    Input:
+      - df (DataFrame): reviews with Rating and Text columns
+
+    Returns: DataFrame
+    '''
+    hashes = pd.util.hash_pandas_object(df[["Rating", "Text"]], index=False)
+
+    return df[~hashes.duplicated().values].reset_index(drop=True)
+
+
+def allocate_samples(group_sizes, num_samples):
+    '''
+    Decide how many reviews to sample from each rating group to achieve
+    the most equal distribution of reviews by rating. If a group has
+    too few reviews, all of them are taken and the shortfall is sampled
+    from the following groups instead.
+
+    Input:
+      - group_sizes (dict): number of reviews with each rating
+      - num_samples (int): total number of reviews to sample
+
+    Returns: dict mapping ratings to sample sizes
+    '''
     remaining_samples = num_samples
-    final_df = pd.DataFrame()
-    remaining_group = 5  # There is 5 rating groups
-    for rating in range(1, 6):
+    remaining_group = len(RATINGS)
+    allocation = {}
+
+    for rating in RATINGS:
         ideal_size = round(remaining_samples / remaining_group)
-        rating_df = concatenated_df[concatenated_df.Rating == rating]
-        rating_size = rating_df.shape[0]
-        size = min(ideal_size, rating_size)
-        rating_sample = rating_df.sample(size, random_state=RANDOM_SEED)
-        final_df = pd.concat([final_df, rating_sample], ignore_index=True)
+        size = min(ideal_size, group_sizes.get(rating, 0))
+        allocation[rating] = size
         remaining_samples -= size
         remaining_group -= 1
 
+    return allocation
+
+
+def stratified_sample(df, num_samples, random_state=RANDOM_SEED):
+    '''
+    Sample a roughly equal number of reviews of each rating, grouping
+    the reviews by rating in a single pass.
+
+    Input:
+      - df (DataFrame): reviews with Rating and Text columns
+      - num_samples (int): total number of reviews to sample
+      - random_state (int): seed of the random sample
+
+    Returns: DataFrame
+    '''
+    groups = df.groupby("Rating").indices
+    allocation = allocate_samples(
+        {rating: len(rows) for rating, rows in groups.items()}, num_samples)
+
+    rating_samples = [df.iloc[groups[rating]].sample(size,
+                                                     random_state=random_state)
+                      for rating, size in allocation.items()
+                      if rating in groups]
+    if not rating_samples:
+        return df.iloc[:0]
+
+    return pd.concat(rating_samples, ignore_index=True)
+
+
+def reservoir_sample(chunks, num_samples, random_state=RANDOM_SEED,
+                     batch_size=100000):
+    '''
+    Streaming version of stratified_sample, for more reviews than fit
+    in memory. Every distinct review gets a pseudo-random key by hashing
+    it with a seeded hash, and for each rating only the num_samples
+    reviews with the smallest keys seen so far are kept. This is a
+    uniform random sample of the distinct reviews, so the final sample
+    sizes per rating are exactly the ones stratified_sample would use.
+    Once a rating has num_samples candidates, reviews with a larger key
+    than its largest one are dropped as soon as they are read, and the
+    remaining reviews are merged into the candidates batch_size at a
+    time rather than after every (small) chunk.
+
+    Input:
+      - chunks (iterable of DataFrames): reviews with Rating and Text
+                                         columns
+      - num_samples (int): total number of reviews to sample
+      - random_state (int): seed of the random sample
+      - batch_size (int): number of reviews read before merging them
+                          into the candidates
+
+    Returns: DataFrame
+    '''
+    hash_key = "{:016d}".format(random_state)[-16:]
+    candidates = pd.DataFrame()
+    # Largest key kept for each rating (no limit until num_samples kept)
+    max_keys = np.full(max(RATINGS) + 1, np.iinfo(np.uint64).max,
+                       dtype=np.uint64)
+    batch = []
+    batch_rows = 0
+
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is not None:
+            chunk = chunk[chunk.Rating.isin(RATINGS)]
+            keys = pd.util.hash_pandas_object(chunk[["Rating", "Text"]],
+                                              index=False,
+                                              hash_key=hash_key).values
+            is_candidate = keys < max_keys[chunk.Rating.values.astype(int)]
+            batch.append(chunk[is_candidate].assign(key=keys[is_candidate]))
+            batch_rows += is_candidate.sum()
+            if batch_rows < batch_size:
+                continue
+        elif not batch:
+            break
+
+        candidates = pd.concat([candidates] + batch, ignore_index=True)
+        candidates = (candidates.drop_duplicates("key")
+                      .sort_values("key", kind="mergesort")
+                      .groupby("Rating").head(num_samples))
+        batch = []
+        batch_rows = 0
+
+        counts = candidates.groupby("Rating").key.agg(["size", "max"])
+        full = counts[counts["size"] >= num_samples]
+        max_keys[full.index.values.astype(int)] = full["max"].values
+
+    if candidates.empty:
+        return pd.DataFrame(columns=["Rating", "Text"])
+
+    allocation = allocate_samples(candidates.Rating.value_counts().to_dict(),
+                                  num_samples)
+    candidates = candidates.sort_values(["Rating", "key"], kind="mergesort")
+    in_sample = (candidates.groupby("Rating").cumcount().values
+                 < candidates.Rating.map(allocation).values)
+
+    return candidates[in_sample][["Rating", "Text"]].reset_index(drop=True)
+
+
+def merge_data(out_csv="test_data/merged_data.csv",
+               scraped_data_dir="scraped_data/", num_samples=10000,
+               dataset_dir=None, streaming=False):
+    '''
+    First, combine all restaurant reviews into one dataframe.
+    Then, try to generate a roughly equal distribution of reviews
+    in terms of rating. Finally, write merged dataset into a CSV.
+
+    Input:
+      - out_csv (str): csv file name for the merged dataset
+      - scraped_data_dir (str): name of directory containing food reviews from 
+                                restaurants in different cities
+      - num_samples (int): total number of reviews selected for merged dataset
+      - dataset_dir (str): if given, reviews are read from the review
+                           dataset in this directory (see review_store.py)
+                           instead of the CSV files in scraped_data_dir
+      - streaming (bool): whether to sample the reviews as they are read
+                          (see reservoir_sample) instead of loading them
+                          all into memory. The sample is just as balanced
+                          but not the same as the one taken otherwise.
+
+    Returns: None, writes to CSV file
+    '''
+    if streaming:
+        if dataset_dir:
+            # pyarrow is only needed when reading the review dataset
+            from review_store import iter_reviews
+
+            chunks = iter_reviews(dataset_dir, columns=["Rating", "Text"])
+        else:
+            chunks = iter_scraped_data(scraped_data_dir)
+        final_df = reservoir_sample(chunks, num_samples)
+        final_df.to_csv(out_csv, index=False)
+        return
+
+    if dataset_dir:
+        # pyarrow is only needed when reading the review dataset
+        from review_store import read_reviews
+
+        concatenated_df = read_reviews(dataset_dir,
+                                       columns=["Rating", "Text"])
+    else:
+        concatenated_df = read_scraped_data(scraped_data_dir)
+
+    # Removing duplicates if present
+    concatenated_df = drop_duplicate_reviews(concatenated_df)
+
+    # Try to achieve the most equal distribution of reviews by rating
+    final_df = stratified_sample(concatenated_df, num_samples)
+
     # Write concat_data to CSV
     final_df.to_csv(out_csv, index=False)
@@ -1,15 +1,33 @@
+import os
+import sys
+import time
+import resource
+import contextlib
+import tempfile
 import pandas as pd
 import numpy as np
 import joblib
 import itertools
+from collections import Counter
+from joblib import Parallel, delayed
 from sklearn import linear_model
 from sklearn.model_selection import train_test_split
 from sklearn.feature_selection import SelectFromModel
 from sklearn.metrics import classification_report
-from analyze_words import get_df_idf_stops
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.pipeline import make_pipeline
+from analyze_words import (TokenizedCorpus, tokenize_corpus,
+                           fit_pretokenized, make_hashing_vectorizer,
+                           tokenize_pool, NUM_HASHED_FEATURES,
+                           TOKENIZER_VERSION)
+from results_store import ResultsStore, dataset_fingerprint
 
 
 RANDOM_SEED = 33
+RATINGS = [1, 2, 3, 4, 5]
+SEARCH_SPACE = {"ngram": [1, 2, 3],
+                "num_stop_words": [0, 10, 20],
+                "alpha": [0.0001, 0.001, 0.01, 0.1, 1]}
 
 
 def evaluate_model(prediction, y_test):
@@ -83,57 +101,364 @@ def feature_selection(model, x_train, y_train, x_test):
     return x_train, x_test, trained_feature_selection_model
 
 
-def optimize_model(csv_file, testing_fraction):
+def peak_rss_mb():
+    '''
+    Get the peak resident memory of this process so far.
+
+    Returns: float (MB)
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+
+    return peak / 2 ** 10
+
+
+def get_sweep_params(config, featurizer, testing_fraction,
+                     training_fraction=1):
+    '''
+    Collect everything a sweep result depends on (besides the dataset
+    and tokenizer), to be used as its key in the results store.
+
+    Inputs:
+      - config (tuple): n-gram length, number of stop words and alpha
+      - featurizer (str): "tfidf" or "hashing"
+      - testing_fraction (float): proportion of data reserved for testing
+      - training_fraction (float): proportion of the training data used
+
+    Returns: dict
+    '''
+    ngram, num_stop_words, alpha = config
+
+    return {"ngram": ngram, "num_stop_words": num_stop_words,
+            "alpha": alpha, "featurizer": featurizer,
+            "testing_fraction": testing_fraction,
+            "training_fraction": training_fraction,
+            "random_seed": RANDOM_SEED}
+
+
+def split_features(corpus, ngram, num_stop_words, featurizer,
+                   testing_fraction):
+    '''
+    Build the feature matrix of a combination and split it into
+    training and testing data. Only the split copies are kept, so the
+    full matrix and its vectorizer can be freed right away.
+
+    Inputs:
+      - corpus (TokenizedCorpus): tokenized reviews
+      - ngram (int): range of n-grams to use
+      - num_stop_words (int): number of stop words to remove
+      - featurizer (str): "tfidf" or "hashing"
+      - testing_fraction (float): proportion of data reserved for testing
+
+    Returns: list of x_train, x_test, y_train, y_test
+    '''
+    X, y_values, _ = corpus.get_features(n=ngram,
+                                         num_stop_words=num_stop_words,
+                                         featurizer=featurizer)
+
+    return train_test_split(X, y_values, test_size=testing_fraction,
+                            random_state=RANDOM_SEED)
+
+
+def optimize_model(csv_file, testing_fraction, n_jobs=-1,
+                   featurizer="tfidf", search_space=SEARCH_SPACE,
+                   search="grid", results_file=None, corpus=None):
     '''
     Find the optimal combination of parameters (maximum n-gram length,
-    number of stop words, and alpha) for the suggested star rating model, 
-    as well as the corresponding x and y values, and vectorizer object.
+    number of stop words, and alpha) for the suggested star rating model.
+
+    Each (ngram, num_stop_words) feature matrix is built and split once,
+    and all alphas are then evaluated against it in parallel. The split
+    matrices are memory-mapped read-only into the worker processes
+    instead of being pickled for each of them. Only the best combination
+    and its accuracy are kept, so a single feature matrix is held in
+    memory at a time; the peak memory so far is printed after each step.
+
+    With a results_file, each accuracy is saved as soon as it is known,
+    and combinations already tested on the same data are not trained
+    again (nor are their features built).
+
+    With search="halving", the combinations are compared with
+    successive_halving instead of the exhaustive grid.
 
     Inputs:
       - csv_file (string): CSV file name
       - testing_fraction (float): proportion of data reserved for testing
-
-    Returns: list of array (best_x), series (best_y), int (best_alpha), 
-             Vectorizer obj (best_vectorizer)
+      - n_jobs (int): number of processes evaluating alphas (all cores
+                      if -1)
+      - featurizer (str): "tfidf" for a vocabulary of n-grams or
+                          "hashing" for hashed n-grams
+      - search_space (dict): values of "ngram", "num_stop_words" and
+                             "alpha" to try
+      - search (str): "grid" or "halving"
+      - results_file (str): SQLite file of the results store (results
+                            are not saved if None)
+      - corpus (TokenizedCorpus): tokenized reviews of csv_file (read
+                                  only if needed when None)
+
+    Returns: tuple (best ngram, num_stop_words and alpha),
+             float (best weighted accuracy)
     '''
+    if search == "halving":
+        return successive_halving(csv_file, testing_fraction,
+                                  search_space=search_space, n_jobs=n_jobs,
+                                  featurizer=featurizer,
+                                  results_file=results_file, corpus=corpus)
+    if search != "grid":
+        raise ValueError("Unknown search: {}".format(search))
+
     # Combinations
-    ngrams = [1, 2, 3]
-    num_stop_words = [0, 10, 20]
-    alphas = [0.0001, 0.001, 0.01, 0.1, 1]
+    ngrams = search_space["ngram"]
+    num_stop_words = search_space["num_stop_words"]
+    alphas = search_space["alpha"]
+
+    feature_combi = list(itertools.product(ngrams, num_stop_words))
 
-    all_combi = list(itertools.product(ngrams, num_stop_words, alphas))
+    store = (ResultsStore(results_file, TOKENIZER_VERSION) if results_file
+             else None)
+    dataset = dataset_fingerprint(csv_file) if store else None
 
     max_accuracy = -1
-    best_x = None
-    best_y = None
-    best_alpha = None
-    best_vectorizer = None
+    best_combi = None
 
     print("Completed initializing.")
 
-    for combi in all_combi:
-        ngram, num_stop_words, alpha = combi
-        X, y_values, vectorizer = get_df_idf_stops(csv_file, n=ngram,
-                                                   num_stop_words=num_stop_words)
-        x_train, x_test, y_train, y_test = \
-            train_test_split(X, y_values, test_size=testing_fraction,
-                             random_state=RANDOM_SEED)
-        weighted_accuracy = get_weighted_accuracy(x_train, x_test,
-                                                  y_train, y_test, alpha)
+    with Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r") as parallel:
+        for ngram, num_stop_words in feature_combi:
+            params = {alpha: get_sweep_params(
+                (ngram, num_stop_words, alpha), featurizer, testing_fraction)
+                for alpha in alphas}
+            accuracies = {}
+            if store:
+                for alpha in alphas:
+                    accuracy = store.get(dataset, params[alpha])
+                    if accuracy is not None:
+                        accuracies[alpha] = accuracy
+
+            missing = [alpha for alpha in alphas if alpha not in accuracies]
+            if missing:
+                # Tokenize the reviews once for the whole sweep, if
+                # anything is missing from the results store
+                if corpus is None:
+                    corpus = TokenizedCorpus(csv_file)
+                split = split_features(corpus, ngram, num_stop_words,
+                                       featurizer, testing_fraction)
+                new_accuracies = parallel(
+                    delayed(get_weighted_accuracy)(*split, alpha)
+                    for alpha in missing)
+                del split
+
+                for alpha, weighted_accuracy in zip(missing, new_accuracies):
+                    accuracies[alpha] = weighted_accuracy
+                    if store:
+                        store.put(dataset, params[alpha], weighted_accuracy)
+
+            for alpha in alphas:
+                weighted_accuracy = accuracies[alpha]
+                combi = (ngram, num_stop_words, alpha)
+                status = ("Finished testing." if alpha in missing
+                          else "Loaded from results.")
+                print(combi, status, "| Accuracy: ", weighted_accuracy)
+
+                if weighted_accuracy > max_accuracy:
+                    max_accuracy = weighted_accuracy
+                    best_combi = combi
+
+            print((ngram, num_stop_words), "Peak RSS: {:.0f} MB".format(
+                peak_rss_mb()))
+
+    return best_combi, max_accuracy
+
+
+def successive_halving(csv_file, testing_fraction, search_space=SEARCH_SPACE,
+                       eta=3, min_fraction=None, n_jobs=-1,
+                       featurizer="tfidf", results_file=None, corpus=None):
+    '''
+    Find the optimal combination of parameters like optimize_model, but
+    with successive halving: every combination is first trained on a
+    small random subsample of the training data, and only the best
+    1/eta of them are promoted to a budget eta times larger, until the
+    survivors are trained on the full training data. All rounds are
+    scored with the weighted accuracy on the same testing data.
+
+    Feature matrices are only built for (ngram, num_stop_words) pairs
+    that still have a surviving alpha to train. Like in optimize_model,
+    each one is built, used to train all of its alphas, and freed before
+    the next one is built, so a single feature matrix is held in memory
+    at a time. Each split is built only once: it is saved to a temporary
+    directory and memory-mapped back in later rounds, and deleted once
+    the pair has no surviving alpha. The peak memory so far is printed
+    after each round.
 
-        print(combi, "Finished testing. | Accuracy: ", weighted_accuracy)
+    Inputs:
+      - csv_file (string): CSV file name
+      - testing_fraction (float): proportion of data reserved for testing
+      - search_space (dict): values of "ngram", "num_stop_words" and
+                             "alpha" to try
+      - eta (int): factor by which combinations are cut and budgets
+                   grow at each round
+      - min_fraction (float): fraction of the training data used in the
+                              first round (by default, chosen so that a
+                              single combination is left for the last
+                              round)
+      - n_jobs (int): number of processes training models (all cores
+                      if -1)
+      - featurizer (str): "tfidf" for a vocabulary of n-grams or
+                          "hashing" for hashed n-grams
+      - results_file (str): SQLite file of the results store (results
+                            are not saved if None)
+      - corpus (TokenizedCorpus): tokenized reviews of csv_file (read
+                                  only if needed when None)
+
+    Returns: tuple (best ngram, num_stop_words and alpha),
+             float (best weighted accuracy)
+    '''
+    start = time.perf_counter()
+    configs = list(itertools.product(search_space["ngram"],
+                                     search_space["num_stop_words"],
+                                     search_space["alpha"]))
+    num_configs = len(configs)
+
+    num_rounds = 1
+    while len(configs) > eta ** num_rounds:
+        num_rounds += 1
+    if min_fraction is None:
+        min_fraction = eta ** -(num_rounds - 1)
+
+    store = (ResultsStore(results_file, TOKENIZER_VERSION) if results_file
+             else None)
+    dataset = dataset_fingerprint(csv_file) if store else None
+
+    total_fits = 0
+    full_fits = 0
+    num_builds = 0
+    num_pairs = len({config[:2] for config in configs})
 
-        if weighted_accuracy > max_accuracy:
-            max_accuracy = weighted_accuracy
-            best_x = X
-            best_y = y_values
-            best_alpha = alpha
-            best_vectorizer = vectorizer
+    print("Completed initializing.")
 
-    return best_x, best_y, best_alpha, best_vectorizer
+    parallel = Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r")
+    with tempfile.TemporaryDirectory() as split_dir, parallel:
+        for round_num in range(num_rounds):
+            fraction = min(1, min_fraction * eta ** round_num)
+            params = [get_sweep_params(config, featurizer, testing_fraction,
+                                       fraction) for config in configs]
+            accuracies = [store.get(dataset, config_params) if store
+                          else None for config_params in params]
+            missing = [i for i, accuracy in enumerate(accuracies)
+                       if accuracy is None]
+
+            # One feature matrix at a time, for all of its missing alphas
+            for key in sorted({configs[i][:2] for i in missing}):
+                split_file = os.path.join(split_dir,
+                                          "{}_{}.pkl".format(*key))
+                if os.path.exists(split_file):
+                    x_train, x_test, y_train, y_test = joblib.load(
+                        split_file, mmap_mode="r")
+                else:
+                    if corpus is None:
+                        corpus = TokenizedCorpus(csv_file)
+                    x_train, x_test, y_train, y_test = split_features(
+                        corpus, key[0], key[1], featurizer,
+                        testing_fraction)
+                    num_builds += 1
+                    if round_num < num_rounds - 1:
+                        joblib.dump((x_train, x_test, y_train, y_test),
+                                    split_file)
+                # train_test_split shuffles, so a prefix of the training
+                # data is a random subsample, nested across rounds
+                num_rows = max(len(RATINGS),
+                               int(round(fraction * x_train.shape[0])))
+                split = (x_train[:num_rows], x_test, y_train.iloc[:num_rows],
+                         y_test)
+                del x_train, y_train
+
+                key_missing = [i for i in missing if configs[i][:2] == key]
+                new_accuracies = parallel(
+                    delayed(get_weighted_accuracy)(*split, configs[i][2])
+                    for i in key_missing)
+                del split
+
+                for i, weighted_accuracy in zip(key_missing, new_accuracies):
+                    accuracies[i] = weighted_accuracy
+                    if store:
+                        store.put(dataset, params[i], weighted_accuracy)
+            total_fits += len(missing)
+            full_fits += len(missing) * fraction
+
+            ranked = sorted(zip(accuracies, range(len(configs))),
+                            key=lambda pair: (-pair[0], pair[1]))
+            for weighted_accuracy, i in ranked:
+                print(configs[i], "Round {} ({:.0%} of training data) |"
+                      " Accuracy: ".format(round_num + 1, fraction),
+                      weighted_accuracy)
+            print("Round {} Peak RSS: {:.0f} MB".format(round_num + 1,
+                                                        peak_rss_mb()))
+
+            if round_num < num_rounds - 1:
+                num_promoted = max(1, -(-len(configs) // eta))
+                pairs = {config[:2] for config in configs}
+                configs = [configs[i] for _, i in ranked[:num_promoted]]
+                for key in pairs - {config[:2] for config in configs}:
+                    split_file = os.path.join(split_dir,
+                                              "{}_{}.pkl".format(*key))
+                    if os.path.exists(split_file):
+                        os.remove(split_file)
+            else:
+                best_combi = configs[ranked[0][1]]
+                max_accuracy = ranked[0][0]
+
+    wall_time = time.perf_counter() - start
+    print("Successive halving: {} fits ({:.1f} full-data equivalents) and "
+          "{} feature matrices built (grid: {} fits, {} matrices) in "
+          "{:.1f}s".format(total_fits, full_fits, num_builds, num_configs,
+                           num_pairs, wall_time))
+
+    return best_combi, max_accuracy
+
+
+def compare_searches(csv_file="test_data/merged_data.csv",
+                     testing_fraction=0.2, search_space=SEARCH_SPACE,
+                     featurizer="tfidf"):
+    '''
+    Run the exhaustive grid and successive halving over the same search
+    space, and report the number of fits, wall time and chosen
+    combination of each.
 
+    Inputs:
+      - csv_file (string): CSV file name
+      - testing_fraction (float): proportion of data reserved for testing
+      - search_space (dict): values of "ngram", "num_stop_words" and
+                             "alpha" to try
+      - featurizer (str): "tfidf" for a vocabulary of n-grams or
+                          "hashing" for hashed n-grams
 
-def main_modelling(csv_file="test_data/merged_data.csv", testing_fraction=0.2):
+    Returns: dict mapping search to (wall time, best combination)
+    '''
+    results = {}
+    for search in ["grid", "halving"]:
+        start = time.perf_counter()
+        best_combi, _ = optimize_model(
+            csv_file, testing_fraction, featurizer=featurizer,
+            search_space=search_space, search=search)
+        results[search] = (time.perf_counter() - start, best_combi)
+
+    num_configs = 1
+    for values in search_space.values():
+        num_configs *= len(values)
+    print("Grid: {} fits in {:.1f}s | Halving: {:.1f}s ({:.1f}x faster)"
+          .format(num_configs, results["grid"][0], results["halving"][0],
+                  results["grid"][0] / results["halving"][0]))
+
+    return results
+
+
+def main_modelling(csv_file="test_data/merged_data.csv", testing_fraction=0.2,
+                   featurizer="tfidf", search="grid",
+                   results_file="optimal_args/sweep_results.sqlite",
+                   leaderboard_file="optimal_args/leaderboard.csv"):
     '''
     Generate the optimal model for predicting Yelp review ratings by
     cycling through combinations of parameters and saving it as a PKL file.
@@ -143,11 +468,31 @@ def main_modelling(csv_file="test_data/merged_data.csv", testing_fraction=0.2):
     Inputs:
       - csv_file (string): CSV file name
       - testing_fraction (float): proportion of data reserved for testing
+      - featurizer (str): "tfidf" for a vocabulary of n-grams or
+                          "hashing" for hashed n-grams
+      - search (str): "grid" or "halving" (see optimize_model)
+      - results_file (str): SQLite file of the results store, so that
+                            reruns skip combinations already tested
+                            (None to always test all of them)
+      - leaderboard_file (str): JSON or CSV file to which the results
+                                on this dataset are saved (not saved if
+                                None)
 
     Returns: None, writes PKL files
     '''
     # Input and Model Tuning
-    X, y_values, alpha, vectorizer = optimize_model(csv_file, testing_fraction)
+    corpus = TokenizedCorpus(csv_file)
+    (ngram, num_stop_words, alpha), _ = optimize_model(
+        csv_file, testing_fraction, featurizer=featurizer, search=search,
+        results_file=results_file, corpus=corpus)
+
+    if results_file and leaderboard_file:
+        ResultsStore(results_file, TOKENIZER_VERSION).write_leaderboard(
+            leaderboard_file, dataset_fingerprint(csv_file))
+
+    # Rebuild the features of the best combination only
+    X, y_values, vectorizer = corpus.get_features(
+        n=ngram, num_stop_words=num_stop_words, featurizer=featurizer)
 
     x_train, x_test, y_train, y_test = \
         train_test_split(X, y_values, test_size=testing_fraction,
@@ -169,3 +514,242 @@ def main_modelling(csv_file="test_data/merged_data.csv", testing_fraction=0.2):
     joblib.dump(final_model, "optimal_args/final_model.pkl")
     joblib.dump(vectorizer, "optimal_args/vectorizer.pkl")
     joblib.dump(feature_selector, "optimal_args/selector.pkl")
+
+
+def iter_review_chunks(data_file, chunk_size):
+    '''
+    Stream reviews in chunks from a CSV file with Rating and Text
+    columns, or from the review dataset directory (see review_store.py).
+
+    Inputs:
+      - data_file (str): CSV file name or review dataset directory
+      - chunk_size (int): number of reviews per chunk
+
+    Returns: generator of DataFrames
+    '''
+    if os.path.isdir(data_file):
+        # pyarrow is only needed when reading the review dataset
+        from review_store import iter_reviews
+
+        chunks = iter_reviews(data_file, batch_size=chunk_size)
+    else:
+        chunks = pd.read_csv(data_file, usecols=["Rating", "Text"],
+                             chunksize=chunk_size)
+
+    for chunk in chunks:
+        chunk = chunk[chunk.Rating.isin(RATINGS)]
+        yield chunk.Rating.astype("int"), chunk.Text.fillna("").astype(str)
+
+
+def is_test_review(texts, testing_fraction):
+    '''
+    Deterministically reserve a fraction of reviews for testing, based
+    on a hash of their text, so that the same reviews are held out in
+    every chunk, epoch and run.
+
+    Inputs:
+      - texts (series): review texts
+      - testing_fraction (float): proportion of data reserved for testing
+
+    Returns: array of bools
+    '''
+    hashes = pd.util.hash_pandas_object(texts, index=False).values
+
+    return (hashes % 1000) < testing_fraction * 1000
+
+
+def fit_streaming_vectorizer(data_file, n, num_stop_words, chunk_size,
+                             n_features, n_jobs=None, executor=None):
+    '''
+    Fit a hashed tf_idf vectorizer one chunk of reviews at a time. The
+    stop words are found in a first pass (if any are removed) and the
+    document frequency of each hashed column is counted in a second
+    one, so memory only depends on chunk_size and n_features.
+
+    Inputs:
+      - data_file (str): CSV file name or review dataset directory
+      - n (int): range of n-grams to use
+      - num_stop_words (int): number of stop words to remove
+      - chunk_size (int): number of reviews per chunk
+      - n_features (int): number of hashed columns
+      - n_jobs (int): number of processes used for tokenizing
+      - executor (ProcessPoolExecutor): pool of processes used for
+                                        tokenizing instead (see
+                                        tokenize_pool)
+
+    Returns: Pipeline obj (hashing vectorizer and idf weights)
+    '''
+    stop_words = []
+    if num_stop_words:
+        word_counts = Counter()
+        for _, texts in iter_review_chunks(data_file, chunk_size):
+            for tokens in tokenize_corpus(texts, n_jobs, executor):
+                word_counts.update(tokens)
+        stop_words = [word for word, _
+                      in word_counts.most_common(num_stop_words)]
+
+    hashing_vectorizer = make_hashing_vectorizer(n, stop_words, n_features)
+    doc_freq = np.zeros(n_features, dtype=np.int64)
+    num_docs = 0
+    for _, texts in iter_review_chunks(data_file, chunk_size):
+        counts = fit_pretokenized(hashing_vectorizer,
+                                  tokenize_corpus(texts, n_jobs, executor))
+        doc_freq += np.bincount(counts.indices, minlength=n_features)
+        num_docs += counts.shape[0]
+
+    # Same smoothed idf as TfidfVectorizer
+    idf_transformer = TfidfTransformer()
+    idf_transformer.idf_ = np.log((1 + num_docs) / (1 + doc_freq)) + 1
+
+    return make_pipeline(hashing_vectorizer, idf_transformer)
+
+
+def stream_train(data_file="test_data/merged_data.csv", alpha=0.0001, n=2,
+                 num_stop_words=0, epochs=5, chunk_size=10000,
+                 testing_fraction=0.2, n_features=NUM_HASHED_FEATURES,
+                 checkpoint_file="optimal_args/stream_checkpoint.pkl",
+                 checkpoint_every=10,
+                 model_file="optimal_args/stream_model.pkl",
+                 vectorizer_file="optimal_args/stream_vectorizer.pkl",
+                 n_jobs=None, shuffle_chunks=5):
+    '''
+    Train the suggested star rating model on any number of reviews with
+    constant memory. Reviews are read one chunk at a time, featurized
+    with a hashed tf_idf vectorizer (fitted in streaming passes), and
+    fed to SGDClassifier.partial_fit, for several epochs. Since files
+    such as merge_data's output are sorted by rating, the training
+    reviews of every shuffle_chunks chunks are shuffled together before
+    being fed to the model. The model is checkpointed every
+    checkpoint_every chunks, and training resumes from the checkpoint
+    if it was made with the same arguments and data, and deletes it
+    once done. The model and vectorizer are saved as PKL files that
+    RatingPredictor can load (without a selector).
+
+    Inputs:
+      - data_file (str): CSV file name or review dataset directory
+      - alpha (float): constant that multiplies regularization term
+      - n (int): range of n-grams to use
+      - num_stop_words (int): number of stop words to remove
+      - epochs (int): number of passes over the training reviews
+      - chunk_size (int): number of reviews per chunk
+      - testing_fraction (float): proportion of data reserved for testing
+      - n_features (int): number of hashed columns
+      - checkpoint_file (str): PKL file of the training checkpoint
+      - checkpoint_every (int): number of chunks between checkpoints
+      - model_file (str): PKL file name for the trained model
+      - vectorizer_file (str): PKL file name for the vectorizer
+      - n_jobs (int): number of processes used for tokenizing
+      - shuffle_chunks (int): number of chunks shuffled together
+
+    Returns: float (weighted accuracy on the testing reviews),
+             writes PKL files
+    '''
+    # One pool for the whole run, so that its token caches stay warm
+    executor = tokenize_pool(n_jobs)
+    with executor or contextlib.nullcontext():
+        params = {"data_file": data_file, "alpha": alpha, "n": n,
+                  "num_stop_words": num_stop_words,
+                  "chunk_size": chunk_size,
+                  "testing_fraction": testing_fraction,
+                  "n_features": n_features, "shuffle_chunks": shuffle_chunks}
+        dataset = dataset_fingerprint(data_file) if checkpoint_file else None
+
+        checkpoint = None
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            checkpoint = joblib.load(checkpoint_file)
+            if (checkpoint.get("params") != params
+                    or checkpoint.get("dataset") != dataset):
+                print("Ignoring a checkpoint made with other arguments "
+                      "or data")
+                checkpoint = None
+            else:
+                print("Resuming from epoch {epoch}, chunk {chunk}".format(
+                    **checkpoint))
+        if checkpoint is None:
+            vectorizer = fit_streaming_vectorizer(
+                data_file, n, num_stop_words, chunk_size, n_features, n_jobs,
+                executor)
+            checkpoint = {"model": linear_model.SGDClassifier(alpha=alpha),
+                          "vectorizer": vectorizer, "epoch": 0, "chunk": 0,
+                          "params": params, "dataset": dataset}
+            print("Fitted the vectorizer.")
+
+        model = checkpoint["model"]
+        vectorizer = checkpoint["vectorizer"]
+        hashing_vectorizer, idf_transformer = [step for _, step
+                                               in vectorizer.steps]
+
+        def featurize(texts):
+            counts = fit_pretokenized(hashing_vectorizer,
+                                      tokenize_corpus(texts, n_jobs,
+                                                      executor))
+            return idf_transformer.transform(counts)
+
+        def save_checkpoint(epoch, chunk):
+            if checkpoint_file:
+                joblib.dump({"model": model, "vectorizer": vectorizer,
+                             "epoch": epoch, "chunk": chunk, "params": params,
+                             "dataset": dataset}, checkpoint_file)
+
+        for epoch in range(checkpoint["epoch"], epochs):
+            start = time.perf_counter()
+            num_reviews = 0
+            first_chunk = (checkpoint["chunk"]
+                           if epoch == checkpoint["epoch"] else 0)
+            last_saved = first_chunk
+            chunks = itertools.islice(
+                iter_review_chunks(data_file, chunk_size), first_chunk, None)
+
+            for i in itertools.count(first_chunk, shuffle_chunks):
+                buffer = list(itertools.islice(chunks, shuffle_chunks))
+                if not buffer:
+                    break
+
+                ratings = pd.concat([chunk_ratings for chunk_ratings, _
+                                     in buffer], ignore_index=True)
+                texts = pd.concat([chunk_texts for _, chunk_texts in buffer],
+                                  ignore_index=True)
+                is_train = ~is_test_review(texts, testing_fraction)
+                ratings, texts = ratings[is_train], texts[is_train]
+
+                # Seeded by position, so a resumed run shuffles the same way
+                rng = np.random.default_rng([RANDOM_SEED, epoch, i])
+                order = rng.permutation(len(texts))
+                for batch_start in range(0, len(order), chunk_size):
+                    rows = order[batch_start:batch_start + chunk_size]
+                    model.partial_fit(featurize(texts.iloc[rows]),
+                                      ratings.iloc[rows], classes=RATINGS)
+                num_reviews += len(order)
+
+                # Checkpoints are only made between buffers
+                if i + len(buffer) - last_saved >= checkpoint_every:
+                    last_saved = i + len(buffer)
+                    save_checkpoint(epoch, last_saved)
+
+            save_checkpoint(epoch + 1, 0)
+            print("Finished epoch {} | {} reviews in {:.1f}s".format(
+                epoch + 1, num_reviews, time.perf_counter() - start))
+
+        # Weighted accuracy over all testing reviews, one chunk at a time
+        total_deviance = 0
+        num_tests = 0
+        for ratings, texts in iter_review_chunks(data_file, chunk_size):
+            is_test = is_test_review(texts, testing_fraction)
+            if is_test.any():
+                prediction = model.predict(featurize(texts[is_test]))
+                total_deviance += np.abs(prediction
+                                         - ratings[is_test].values).sum()
+                num_tests += is_test.sum()
+
+        # Same weighted accuracy as evaluate_model, accumulated over chunks
+        weighted_accuracy = (1 - total_deviance / (4 * num_tests)
+                             if num_tests else None)
+        print("Accuracy Score")
+        print(weighted_accuracy)
+
+        joblib.dump(model, model_file)
+        joblib.dump(vectorizer, vectorizer_file)
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+        return weighted_accuracy
@@ -0,0 +1,101 @@
+import copy
+from spelling import SpellCorrector
+
+
+MODEL_FILE = "optimal_args/final_model.pkl"
+VECTORIZER_FILE = "optimal_args/vectorizer.pkl"
+SELECTOR_FILE = "optimal_args/selector.pkl"
+
+
+class RatingPredictor:
+    '''
+    Suggest star ratings for reviews using the saved model, vectorizer
+    and selector PKL files. The three files are loaded once, when the
+    predictor is created, so each prediction only pays for the TF-IDF
+    transform and the model's dot product.
+    '''
+
+    def __init__(self, model_file=MODEL_FILE, vectorizer_file=VECTORIZER_FILE,
+                 selector_file=SELECTOR_FILE, autocorrect=True,
+                 corrector=None):
+        '''
+        Load the saved model, vectorizer and selector objects.
+
+        Inputs:
+          - model_file (str): PKL file of the trained model
+          - vectorizer_file (str): PKL file of the fitted vectorizer
+          - selector_file (str): PKL file of the fitted feature selector,
+                                 or None for models trained without
+                                 feature selection (e.g. stream_train)
+          - autocorrect (bool): whether to fix spelling errors in
+                                reviews before vectorizing them (not
+                                possible with hashed vectorizers,
+                                which have no vocabulary)
+          - corrector (SpellCorrector): spelling corrector, built over
+                                        the vectorizer's vocabulary if
+                                        None
+        '''
+        # joblib (and sklearn, when unpickling) are only imported once
+        # a predictor is needed
+        import joblib
+
+        self.model = joblib.load(model_file)
+        self.vectorizer = joblib.load(vectorizer_file)
+        self.selector = joblib.load(selector_file) if selector_file else None
+
+        self.corrector = None
+        if autocorrect and hasattr(self.vectorizer, "vocabulary_"):
+            self.corrector = (corrector if corrector is not None else
+                              SpellCorrector.from_vectorizer(self.vectorizer))
+
+        # Correct the tokens of each review as the vectorizer splits
+        # them, on a copy so that the loaded vectorizer is unchanged
+        if self.corrector is not None:
+            self.vectorizer = copy.copy(self.vectorizer)
+            self.vectorizer.set_params(tokenizer=self.corrector.tokenize)
+
+    def transform(self, reviews):
+        '''
+        Convert reviews into the feature selected tfidf array used
+        by the model, correcting their spelling if autocorrect is
+        enabled.
+
+        Inputs:
+          - reviews (list of str): review texts
+
+        Returns: sparse matrix
+        '''
+        x_array = self.vectorizer.transform(reviews)
+
+        if self.selector is None:
+            return x_array
+
+        return self.selector.transform(x_array)
+
+    def predict_many(self, reviews):
+        '''
+        Suggest a star rating for each review.
+
+        Inputs:
+          - reviews (list of str): review texts
+
+        Returns: list of int
+        '''
+        reviews = list(reviews)
+        if not reviews:
+            return []
+
+        prediction = self.model.predict(self.transform(reviews))
+
+        return [int(rating) for rating in prediction]
+
+    def predict(self, review):
+        '''
+        Suggest a star rating for a single review.
+
+        Inputs:
+          - review (str): review text
+
+        Returns: int
+        '''
+        return self.predict_many([review])[0]
@@ -0,0 +1,206 @@
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+def dataset_fingerprint(csv_file, block_size=2 ** 20):
+    '''
+    Hash the contents of a dataset, so that sweep results are reused
+    only as long as the data they were computed on is unchanged.
+
+    Inputs:
+      - csv_file (str): CSV file name, or directory (e.g. the review
+                        dataset) whose files are all hashed
+      - block_size (int): number of bytes read at a time
+
+    Returns: str (SHA-256 hash of the file)
+    '''
+    filenames = [csv_file]
+    if os.path.isdir(csv_file):
+        filenames = sorted(os.path.join(root, name)
+                           for root, _, names in os.walk(csv_file)
+                           for name in names)
+
+    digest = hashlib.sha256()
+    for filename in filenames:
+        if filename != csv_file:
+            digest.update(os.path.relpath(filename, csv_file).encode())
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+class ResultsStore:
+    '''
+    Persistent record of sweep results, kept in a SQLite database. Each
+    weighted accuracy is stored under a hash of the dataset, the
+    tokenizer version and the hyperparameters it was computed with, so
+    that a rerun of the sweep on unchanged data skips the combinations
+    already tested, and an interrupted sweep resumes where it stopped.
+    '''
+
+    def __init__(self, db_file, tokenizer_version):
+        '''
+        Open (or create) the results database.
+
+        Inputs:
+          - db_file (str): SQLite database file name
+          - tokenizer_version (str): version of the tokenizer the
+                                     results are computed with
+                                     (analyze_words.TOKENIZER_VERSION)
+        '''
+        self.tokenizer_version = tokenizer_version
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    dataset TEXT NOT NULL,
+                    tokenizer_version TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    accuracy REAL NOT NULL,
+                    finished_at REAL NOT NULL)''')
+
+    def make_key(self, dataset, params):
+        '''
+        Hash a dataset fingerprint, the tokenizer version and a set of
+        hyperparameters into the key of a result.
+
+        Inputs:
+          - dataset (str): fingerprint of the dataset
+          - params (dict): hyperparameters of the result
+
+        Returns: str
+        '''
+        record = {"dataset": dataset,
+                  "tokenizer_version": self.tokenizer_version,
+                  "params": params}
+
+        return hashlib.sha256(json.dumps(record, sort_keys=True)
+                              .encode("utf-8")).hexdigest()
+
+    def get(self, dataset, params):
+        '''
+        Look up the weighted accuracy of a combination of parameters.
+
+        Inputs:
+          - dataset (str): fingerprint of the dataset
+          - params (dict): hyperparameters of the result
+
+        Returns: float if already computed, None otherwise
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT accuracy FROM results WHERE key = ?",
+                (self.make_key(dataset, params),)).fetchone()
+
+        return row[0] if row else None
+
+    def put(self, dataset, params, accuracy):
+        '''
+        Record the weighted accuracy of a combination of parameters.
+
+        Inputs:
+          - dataset (str): fingerprint of the dataset
+          - params (dict): hyperparameters of the result
+          - accuracy (float): weighted accuracy
+        '''
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(dataset, params), dataset,
+                 self.tokenizer_version, json.dumps(params, sort_keys=True),
+                 float(accuracy), time.time()))
+
+    def leaderboard(self, dataset=None, training_fraction=1,
+                    all_versions=False):
+        '''
+        List the results from the best to the worst weighted accuracy.
+        By default, only results trained on all the training data (not
+        the smaller budgets of successive halving) with the current
+        tokenizer are listed, since the others are not comparable.
+
+        Inputs:
+          - dataset (str): fingerprint of the dataset (all if None)
+          - training_fraction (float): proportion of the training data
+                                       used (all results if None)
+          - all_versions (bool): whether to list the results of older
+                                 tokenizer versions too
+
+        Returns: list of dicts
+        '''
+        sql = ("SELECT dataset, tokenizer_version, params, accuracy "
+               "FROM results")
+        conditions = []
+        params = []
+        if dataset is not None:
+            conditions.append("dataset = ?")
+            params.append(dataset)
+        if not all_versions:
+            conditions.append("tokenizer_version = ?")
+            params.append(self.tokenizer_version)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY accuracy DESC",
+                                     params).fetchall()
+
+        results = [dict(json.loads(result_params), accuracy=accuracy,
+                        dataset=fingerprint, tokenizer_version=version)
+                   for fingerprint, version, result_params, accuracy in rows]
+        if training_fraction is not None:
+            results = [result for result in results
+                       if result.get("training_fraction", 1)
+                       == training_fraction]
+
+        return results
+
+    def write_leaderboard(self, filename, dataset=None, training_fraction=1,
+                          all_versions=False):
+        '''
+        Save the leaderboard as a JSON file (if filename ends in .json)
+        or a CSV file.
+
+        Inputs:
+          - filename (str): output file name
+          - dataset (str): fingerprint of the dataset (all if None)
+          - training_fraction (float): proportion of the training data
+                                       used (all results if None)
+          - all_versions (bool): whether to list the results of older
+                                 tokenizer versions too
+
+        Returns: list of dicts, writes a file
+        '''
+        results = self.leaderboard(dataset, training_fraction, all_versions)
+
+        if filename.endswith(".json"):
+            with open(filename, "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            columns = []
+            for result in results:
+                columns += [key for key in result if key not in columns]
+            with open(filename, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(results)
+
+        return results
+
+
+if __name__ == "__main__":
+    # Only the command line needs the current tokenizer version
+    from analyze_words import TOKENIZER_VERSION
+
+    ResultsStore(sys.argv[1], TOKENIZER_VERSION).write_leaderboard(
+        sys.argv[2])
@@ -0,0 +1,316 @@
+import os
+import uuid
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+REVIEW_SCHEMA = pa.schema([("city", pa.string()),
+                           ("restaurant", pa.int32()),
+                           ("review", pa.int32()),
+                           ("Rating", pa.uint8()),
+                           ("Text", pa.string())])
+
+
+def write_reviews(dataset_dir, df):
+    '''
+    Append reviews to the review dataset, a directory of Parquet files
+    partitioned by city (dataset_dir/city=<city>/*.parquet). Files are
+    never rewritten, each call adds new ones.
+
+    Inputs:
+      - dataset_dir (str): directory of the review dataset
+      - df (DataFrame): reviews with city, restaurant, review (index of
+                        the review within its restaurant), Rating and
+                        Text columns
+
+    Returns: None, writes Parquet files
+    '''
+    table = pa.Table.from_pandas(df[REVIEW_SCHEMA.names],
+                                 schema=REVIEW_SCHEMA, preserve_index=False)
+    ds.write_dataset(table, dataset_dir, format="parquet",
+                     partitioning=["city"], partitioning_flavor="hive",
+                     existing_data_behavior="overwrite_or_ignore",
+                     basename_template="part-" + uuid.uuid4().hex
+                     + "-{i}.parquet")
+
+
+def read_reviews(dataset_dir, columns=("Rating", "Text"), cities=None,
+                 ratings=None):
+    '''
+    Read reviews from the review dataset, loading only the columns,
+    city partitions and ratings asked for. Reviews are returned in
+    (city, restaurant, review) order.
+
+    Inputs:
+      - dataset_dir (str): directory of the review dataset
+      - columns (list of str): columns to read
+      - cities (list of str): cities to read (all if None)
+      - ratings (list of int): ratings to read (all if None)
+
+    Returns: DataFrame
+    '''
+    dataset = ds.dataset(dataset_dir, format="parquet",
+                         partitioning="hive", schema=REVIEW_SCHEMA)
+
+    condition = None
+    if cities is not None:
+        condition = ds.field("city").isin(list(cities))
+    if ratings is not None:
+        rating_condition = ds.field("Rating").isin(list(ratings))
+        condition = (rating_condition if condition is None
+                     else condition & rating_condition)
+
+    sort_columns = ["city", "restaurant", "review"]
+    table = dataset.to_table(columns=list(set(columns) | set(sort_columns)),
+                             filter=condition)
+    table = table.sort_by([(column, "ascending")
+                           for column in sort_columns])
+
+    return table.select(list(columns)).to_pandas()
+
+
+def iter_reviews(dataset_dir, columns=("Rating", "Text"),
+                 batch_size=100000):
+    '''
+    Stream reviews from the review dataset in batches, loading only
+    the columns asked for.
+
+    Inputs:
+      - dataset_dir (str): directory of the review dataset
+      - columns (list of str): columns to read
+      - batch_size (int): maximum number of reviews per batch
+
+    Returns: generator of DataFrames
+    '''
+    dataset = ds.dataset(dataset_dir, format="parquet",
+                         partitioning="hive", schema=REVIEW_SCHEMA)
+
+    for batch in dataset.to_batches(columns=list(columns),
+                                    batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+SMALL_FILE_SIZE = 64 * 2 ** 20  # Parquet files merged by compact_reviews
+
+
+def compact_reviews(dataset_dir, city, small_file_size=SMALL_FILE_SIZE):
+    '''
+    Merge the small files of a city's partition (left by crawls that
+    append a few reviews at a time) into a single file. Large files are
+    left alone, so that compacting does not rewrite the whole city.
+
+    Inputs:
+      - dataset_dir (str): directory of the review dataset
+      - city (str): name of the city
+      - small_file_size (int): size in bytes below which files are merged
+
+    Returns: (int) number of files merged, rewrites Parquet files
+    '''
+    dataset = ds.dataset(dataset_dir, format="parquet",
+                         partitioning="hive", schema=REVIEW_SCHEMA)
+    paths = [fragment.path for fragment
+             in dataset.get_fragments(filter=ds.field("city") == city)
+             if os.path.getsize(fragment.path) < small_file_size]
+    if len(paths) < 2:
+        return 0
+
+    small_files = ds.dataset(paths, format="parquet", partitioning="hive",
+                             partition_base_dir=dataset_dir,
+                             schema=REVIEW_SCHEMA)
+    table = small_files.to_table().sort_by([("restaurant", "ascending"),
+                                            ("review", "ascending")])
+    # The merged file is written before the small ones are removed, so
+    # that a crash in between duplicates reviews instead of losing them
+    write_reviews(dataset_dir, table.to_pandas())
+    for path in paths:
+        os.remove(path)
+
+    return len(paths)
+
+
+class ReviewWriter:
+    '''
+    Buffer the reviews scraped from the restaurants of one city and
+    append them to the review dataset in large batches, so that a crawl
+    adds a few large files instead of one per page of reviews. Functions
+    registered with after_flush (e.g. marking a page of reviews as done
+    in the crawl state) are only called once the reviews written before
+    them are on disk. Can be shared by several threads.
+    '''
+
+    def __init__(self, dataset_dir, city, batch_size=10000, compact=True):
+        '''
+        Inputs:
+          - dataset_dir (str): directory of the review dataset
+          - city (str): name of the city
+          - batch_size (int): number of rows buffered before writing
+          - compact (bool): whether to merge the city's small files
+                            when the writer is closed
+        '''
+        self.dataset_dir = dataset_dir
+        self.city = city
+        self.batch_size = batch_size
+        self.compact = compact
+        self.rows = []
+        self.callbacks = []
+        self.lock = threading.RLock()
+
+    def restaurant(self, restaurant, first_review=0):
+        '''
+        Get a writer for the reviews of one restaurant, a drop-in
+        replacement for the CSV writer used by crawl_and_scrape.
+
+        Inputs:
+          - restaurant (int): index of the restaurant in its city
+          - first_review (int): index given to the first review written
+
+        Returns: RestaurantWriter obj
+        '''
+        return RestaurantWriter(self, restaurant, first_review)
+
+    def add(self, restaurant, review, rating, text):
+        '''
+        Buffer a review, writing the buffer once it is full.
+
+        Inputs:
+          - restaurant (int): index of the restaurant in its city
+          - review (int): index of the review within its restaurant
+          - rating (int): star rating
+          - text (str): text of the review
+        '''
+        with self.lock:
+            self.rows.append((self.city, restaurant, review, rating, text))
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+
+    def after_flush(self, callback, *args):
+        '''
+        Call a function once the reviews buffered so far are written.
+
+        Inputs:
+          - callback (function): function to call
+          - args: arguments of the function
+        '''
+        with self.lock:
+            self.callbacks.append((callback, args))
+
+    def flush(self):
+        '''
+        Write the buffered reviews to the dataset, then call the
+        functions waiting for them.
+        '''
+        with self.lock:
+            if self.rows:
+                write_reviews(self.dataset_dir,
+                              pd.DataFrame(self.rows,
+                                           columns=REVIEW_SCHEMA.names))
+                self.rows = []
+            for callback, args in self.callbacks:
+                callback(*args)
+            self.callbacks = []
+
+    def close(self):
+        '''
+        Write the buffered reviews, and merge the city's small files.
+        '''
+        self.flush()
+        if self.compact:
+            compact_reviews(self.dataset_dir, self.city)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RestaurantWriter:
+    '''
+    Writer of the [rating, text] rows of one restaurant, numbering its
+    reviews and passing them on to the ReviewWriter of its city.
+    '''
+
+    def __init__(self, city_writer, restaurant, first_review=0):
+        '''
+        Inputs:
+          - city_writer (ReviewWriter): writer of the city
+          - restaurant (int): index of the restaurant in its city
+          - first_review (int): index given to the first review written
+        '''
+        self.city_writer = city_writer
+        self.restaurant = restaurant
+        self.next_review = first_review
+
+    def writerow(self, row):
+        '''
+        Add a review to the dataset.
+
+        Inputs:
+          - row (list): rating and text of the review
+        '''
+        rating, text = row
+        self.city_writer.add(self.restaurant, self.next_review, rating, text)
+        self.next_review += 1
+
+    def after_flush(self, callback, *args):
+        '''
+        Call a function once the reviews written so far are on disk.
+
+        Inputs:
+          - callback (function): function to call
+          - args: arguments of the function
+        '''
+        self.city_writer.after_flush(callback, *args)
+
+
+def convert_csv_tree(scraped_data_dir="scraped_data/",
+                     dataset_dir="scraped_reviews/"):
+    '''
+    One-shot conversion of the scraped_data tree (one headerless CSV
+    per restaurant, grouped in one directory per city) into the review
+    dataset. Each city is written as a single partition.
+
+    Inputs:
+      - scraped_data_dir (str): name of directory containing food
+                                reviews from restaurants in different
+                                cities
+      - dataset_dir (str): directory of the review dataset
+
+    Returns: (int) number of reviews converted, writes Parquet files
+    '''
+    total_reviews = 0
+
+    for city in sorted(os.listdir(scraped_data_dir)):
+        city_dir = os.path.join(scraped_data_dir, city)
+        if not os.path.isdir(city_dir):
+            continue
+
+        city_dfs = []
+        for file_name in os.listdir(city_dir):
+            path = os.path.join(city_dir, file_name)
+            restaurant, ext = os.path.splitext(file_name)
+            if ext != ".csv" or not restaurant.isdigit():
+                continue
+            if os.path.getsize(path) == 0:
+                continue
+
+            df = pd.read_csv(path, usecols=[0, 1], names=["Rating", "Text"],
+                             header=None)
+            df["city"] = city
+            df["restaurant"] = int(restaurant)
+            df["review"] = range(len(df))
+            city_dfs.append(df)
+
+        if city_dfs:
+            city_df = pd.concat(city_dfs, ignore_index=True)
+            write_reviews(dataset_dir, city_df)
+            total_reviews += len(city_df)
+            print("Converted {} reviews from {}".format(len(city_df), city))
+
+    return total_reviews
+
+
+if __name__ == "__main__":
+    convert_csv_tree()
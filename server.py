@@ -0,0 +1,291 @@
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from predictor import RatingPredictor
+
+
+HOST = "127.0.0.1"  # Only reachable from this machine
+PORT = 8122
+MAX_BATCH_SIZE = 64
+MAX_WAIT = 0.005  # Seconds a review waits for others to join its batch
+LATENCY_WINDOW = 10000  # Number of recent requests kept for percentiles
+
+
+class MicroBatcher:
+    '''
+    Collect the reviews of concurrent requests and score them together.
+    A single worker thread waits for a review, then keeps collecting
+    reviews for up to max_wait seconds (or until max_batch_size of
+    them are waiting), and scores them all as one sparse matrix with
+    predict_many. Each review gets a Future holding its star rating.
+    '''
+
+    def __init__(self, predictor, max_batch_size=MAX_BATCH_SIZE,
+                 max_wait=MAX_WAIT):
+        '''
+        Start the worker thread.
+
+        Inputs:
+          - predictor (RatingPredictor): preloaded predictor
+          - max_batch_size (int): maximum number of reviews per batch
+          - max_wait (float): maximum seconds spent collecting a batch
+        '''
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, review):
+        '''
+        Queue a review to be scored in the next batch.
+
+        Inputs:
+          - review (str): review text
+
+        Returns: Future (int star rating)
+        '''
+        future = Future()
+        self.pending.put((review, future))
+
+        return future
+
+    def next_batch(self):
+        '''
+        Wait for a review, then collect the reviews arriving within
+        max_wait seconds, up to max_batch_size of them.
+
+        Returns: list of (str, Future) tuples
+        '''
+        batch = [self.pending.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    batch.append(self.pending.get(timeout=timeout))
+                else:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        '''
+        Score batches of reviews until the program exits.
+        '''
+        while True:
+            batch = self.next_batch()
+            reviews = [review for review, _ in batch]
+            self.batch_sizes.append(len(batch))
+
+            try:
+                ratings = self.predictor.predict_many(reviews)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), rating in zip(batch, ratings):
+                future.set_result(rating)
+
+
+class LatencyStats:
+    '''
+    Thread-safe record of recent request latencies.
+    '''
+
+    def __init__(self, window=LATENCY_WINDOW):
+        '''
+        Inputs:
+          - window (int): number of recent requests kept
+        '''
+        self.latencies = deque(maxlen=window)
+        self.num_requests = 0
+        self.num_errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        '''
+        Record the latency of a request.
+
+        Inputs:
+          - seconds (float): time taken to answer the request
+          - error (bool): whether the request failed
+        '''
+        with self.lock:
+            self.latencies.append(seconds)
+            self.num_requests += 1
+            self.num_errors += error
+
+    def summary(self):
+        '''
+        Summarize the recent latencies.
+
+        Returns: dict
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            summary = {"requests": self.num_requests,
+                       "errors": self.num_errors}
+
+        if len(latencies):
+            summary["p50_ms"] = np.percentile(latencies, 50) * 1000
+            summary["p99_ms"] = np.percentile(latencies, 99) * 1000
+            summary["mean_ms"] = latencies.mean() * 1000
+
+        return summary
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    '''
+    Answer requests to the prediction server:
+      - POST /predict with {"review": text} or {"reviews": [texts]}
+        returns {"rating": int} or {"ratings": [ints]} (an empty list
+        of reviews gets an empty list of ratings)
+      - GET /health returns {"status": "ok"}
+      - GET /metrics returns the request count and p50/p99 latencies
+    '''
+
+    def send_json(self, status, obj):
+        '''
+        Send a JSON response.
+
+        Inputs:
+          - status (int): HTTP status code
+          - obj (dict): response body
+        '''
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            metrics = self.server.stats.summary()
+            batch_sizes = list(self.server.batcher.batch_sizes)
+            if batch_sizes:
+                metrics["mean_batch_size"] = np.mean(batch_sizes)
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise TypeError("Expected a JSON object")
+            single = "review" in request
+            reviews = [request["review"]] if single else request["reviews"]
+            # A string would otherwise be scored one character at a time
+            if not isinstance(reviews, list):
+                raise TypeError("Expected a list of reviews")
+            if not all(isinstance(review, str) for review in reviews):
+                raise TypeError("Reviews must be strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self.server.stats.record(time.perf_counter() - start, True)
+            self.send_json(400, {"error": str(e)})
+            return
+
+        if not reviews:
+            self.server.stats.record(time.perf_counter() - start)
+            self.send_json(200, {"ratings": []})
+            return
+
+        try:
+            futures = [self.server.batcher.submit(review)
+                       for review in reviews]
+            ratings = [future.result() for future in futures]
+        except Exception as e:
+            self.server.stats.record(time.perf_counter() - start, True)
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.server.stats.record(time.perf_counter() - start)
+        if single:
+            self.send_json(200, {"rating": ratings[0]})
+        else:
+            self.send_json(200, {"ratings": ratings})
+
+    def log_message(self, format, *args):
+        # Per-request logging would cost more than the prediction
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+    '''
+    HTTP server answering each connection in its own thread, with a
+    listen backlog large enough for bursts of concurrent requests.
+    '''
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(predictor=None, port=PORT, max_batch_size=MAX_BATCH_SIZE,
+                max_wait=MAX_WAIT):
+    '''
+    Create the prediction server, listening on localhost only.
+
+    Inputs:
+      - predictor (RatingPredictor): preloaded predictor, created
+                                     from the PKL files if not given
+      - port (int): port to listen on (any free port if 0)
+      - max_batch_size (int): maximum number of reviews per batch
+      - max_wait (float): maximum seconds spent collecting a batch
+
+    Returns: PredictionServer obj
+    '''
+    if predictor is None:
+        predictor = RatingPredictor()
+
+    server = PredictionServer((HOST, port), PredictionHandler)
+    server.batcher = MicroBatcher(predictor, max_batch_size, max_wait)
+    server.stats = LatencyStats()
+
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve star rating predictions on localhost.")
+    parser.add_argument("--port", type=int, default=PORT,
+                        help="port to listen on")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="maximum number of reviews scored together")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT * 1000,
+                        help="milliseconds spent collecting a batch")
+    parser.add_argument("--no-autocorrect", action="store_true",
+                        help="do not fix spelling errors before scoring")
+    args = parser.parse_args()
+
+    server = make_server(RatingPredictor(autocorrect=not args.no_autocorrect),
+                         args.port, args.max_batch_size,
+                         args.max_wait / 1000)
+    print("Serving predictions on http://{}:{}".format(
+        *server.server_address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,202 @@
+import functools
+from analyze_words import processing, CACHE_SIZE
+
+
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7  # Only the start of longer words is indexed
+LETTERS_PER_EDIT = 4  # Words shorter than this are never corrected
+
+
+def get_deletes(word, max_edit_distance):
+    '''
+    Find every string obtained by deleting up to max_edit_distance
+    characters from a word.
+
+    Inputs:
+      - word (str): word
+      - max_edit_distance (int): maximum number of deleted characters
+
+    Returns: set of str (including the word itself)
+    '''
+    deletes = {word}
+    edits = {word}
+
+    for _ in range(max_edit_distance):
+        edits = {edit[:i] + edit[i + 1:] for edit in edits
+                 for i in range(len(edit))}
+        deletes |= edits
+
+    return deletes
+
+
+def edit_distance(word, other, max_edit_distance):
+    '''
+    Calculate the number of insertions, deletions, substitutions and
+    transpositions of adjacent characters needed to turn one word into
+    another (optimal string alignment distance), giving up as soon as it
+    exceeds max_edit_distance.
+
+    Inputs:
+      - word (str): first word
+      - other (str): second word
+      - max_edit_distance (int): largest distance of interest
+
+    Returns: int (max_edit_distance + 1 if larger)
+    '''
+    too_far = max_edit_distance + 1
+    if abs(len(word) - len(other)) > max_edit_distance:
+        return too_far
+
+    previous_row = None
+    row = list(range(len(other) + 1))
+    for i in range(1, len(word) + 1):
+        before_row, previous_row = previous_row, row
+        row = [i] + [0] * len(other)
+        for j in range(1, len(other) + 1):
+            cost = word[i - 1] != other[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1,
+                         previous_row[j - 1] + cost)
+            if (i > 1 and j > 1 and word[i - 1] == other[j - 2]
+                    and word[i - 2] == other[j - 1]):
+                row[j] = min(row[j], before_row[j - 2] + 1)
+        if min(row) > max_edit_distance:
+            return too_far
+
+    return min(row[-1], too_far)
+
+
+class SpellCorrector:
+    '''
+    Symmetric delete (SymSpell) spelling corrector over the words known
+    to the model. Every string obtained by deleting up to
+    max_edit_distance characters from a known word is indexed once, so
+    correcting a word only needs the deletes of that word and a few
+    dictionary lookups, instead of generating and checking every
+    possible edit as TextBlob does. Known words (and words that should
+    never be corrected, such as stop words) are left as they are, short
+    words are only corrected by few edits, and corrections are cached
+    per word.
+    '''
+
+    def __init__(self, words, max_edit_distance=MAX_EDIT_DISTANCE,
+                 prefix_length=PREFIX_LENGTH, cache_size=CACHE_SIZE,
+                 keep=(), letters_per_edit=LETTERS_PER_EDIT):
+        '''
+        Build the index of deletes.
+
+        Inputs:
+          - words (dict): known words mapped to a rank (lower is more
+                          common), used to choose between corrections
+                          at the same distance
+          - max_edit_distance (int): largest number of edits corrected
+          - prefix_length (int): number of leading characters indexed
+          - cache_size (int): number of distinct corrections remembered
+          - keep (iterable of str): words that are never corrected
+          - letters_per_edit (int): number of letters a word needs for
+                                    each edit made to correct it
+        '''
+        self.words = words
+        self.keep = frozenset(keep)
+        self.letters_per_edit = letters_per_edit
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.deletes = {}
+
+        for word in words:
+            for delete in get_deletes(word[:prefix_length],
+                                      max_edit_distance):
+                self.deletes.setdefault(delete, []).append(word)
+
+        self.correct_word = functools.lru_cache(maxsize=cache_size)(
+            self._correct_word)
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer, **kwargs):
+        '''
+        Build a corrector over the single words in the vocabulary of a
+        fitted TfidfVectorizer, ranking them by idf. The vectorizer's
+        stop words are not in its vocabulary, but are never corrected
+        (otherwise "the" would become "they" and survive their removal).
+
+        Inputs:
+          - vectorizer (TfidfVectorizer): fitted vectorizer
+          - kwargs: other arguments of SpellCorrector
+
+        Returns: SpellCorrector obj
+        '''
+        if not hasattr(vectorizer, "vocabulary_"):
+            raise ValueError("Spelling correction needs a vectorizer with "
+                             "a vocabulary, not hashed features")
+
+        idf = getattr(vectorizer, "idf_", None)
+        words = {term: (idf[column] if idf is not None else 0)
+                 for term, column in vectorizer.vocabulary_.items()
+                 if " " not in term}
+
+        stop_words = vectorizer.get_stop_words() or ()
+        kwargs["keep"] = set(kwargs.get("keep", ())) | set(stop_words)
+
+        return cls(words, **kwargs)
+
+    def _correct_word(self, word):
+        '''
+        Find the closest known word, preferring the most common one
+        among those at the same distance. A word can only be corrected
+        by one edit per letters_per_edit letters, so short words are
+        not turned into unrelated ones.
+
+        Inputs:
+          - word (str): token
+
+        Returns: str (the token itself if known, kept, or nothing is
+                 close)
+        '''
+        max_distance = min(self.max_edit_distance,
+                           len(word) // self.letters_per_edit)
+        if word in self.words or word in self.keep or not max_distance:
+            return word
+
+        candidates = set()
+        for delete in get_deletes(word[:self.prefix_length], max_distance):
+            candidates.update(self.deletes.get(delete, ()))
+
+        best = None
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                key = (distance, self.words[candidate], candidate)
+                if best is None or key < best:
+                    best = key
+
+        return best[2] if best else word
+
+    def correct_tokens(self, tokens):
+        '''
+        Correct the tokens of a review.
+
+        Inputs:
+          - tokens (list of str): tokens of a review
+
+        Returns: list of str
+        '''
+        return [self.correct_word(token) for token in tokens]
+
+    def tokenize(self, text):
+        '''
+        Tokenize a review like analyze_words.processing and correct its
+        tokens, so it can be used as a vectorizer's tokenizer.
+
+        Inputs:
+          - text (str): text of a review
+
+        Returns: list of str
+        '''
+        return self.correct_tokens(processing(text))
+
+    def cache_stats(self):
+        '''
+        Report how often corrections were served from the cache.
+
+        Returns: CacheInfo (hits, misses, maxsize, currsize)
+        '''
+        return self.correct_word.cache_info()
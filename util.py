@@ -1,26 +1,241 @@
+import time
+import threading
 import urllib.parse
 import urllib3
 import certifi
 
 
 MAIN_URL = "https://www.yelp.com"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
+_client = None  # HttpClient shared by read_url, see get_client
+_client_lock = threading.Lock()
 
-def read_url(my_url):
+
+class HttpClient:
+    '''
+    HTTP client backed by one pool of keep-alive connections, so that
+    pages from the same host reuse an open TCP+TLS connection instead
+    of paying for a new handshake every time. Failed requests are
+    retried with exponential backoff, responses are gzip-compressed,
+    and the latency of each request is recorded.
+    '''
+
+    def __init__(self, pool_size=10, num_pools=10, connect_timeout=5.0,
+                 read_timeout=30.0, retries=3, backoff_factor=0.5):
+        '''
+        Inputs:
+          - pool_size (int): connections kept alive per host
+          - num_pools (int): number of hosts with a connection pool
+          - connect_timeout (float): seconds to wait for a connection
+          - read_timeout (float): seconds to wait for a response
+          - retries (int): retries for connection errors and
+                           429/5xx responses
+          - backoff_factor (float): sleep backoff_factor * 2 ** (n - 1)
+                                    seconds before the nth retry
+        '''
+        self.pool_manager = urllib3.PoolManager(
+            num_pools=num_pools,
+            maxsize=pool_size,
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=certifi.where(),
+            headers=urllib3.make_headers(keep_alive=True,
+                                         accept_encoding="gzip"),
+            timeout=urllib3.Timeout(connect=connect_timeout,
+                                    read=read_timeout),
+            retries=urllib3.Retry(total=retries,
+                                  backoff_factor=backoff_factor,
+                                  status_forcelist=RETRY_STATUSES,
+                                  raise_on_status=False))
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def get(self, url):
+        '''
+        Load HTML from URL. Return result or empty string if the
+        read fails.
+
+        Inputs:
+          - url (str): URL
+
+        Returns: bytes
+        '''
+        start = time.perf_counter()
+        try:
+            data = self.pool_manager.request("GET", url).data
+            failed = False
+        except urllib3.exceptions.HTTPError:
+            data = b""
+            failed = True
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.num_requests += 1
+            self.num_failures += failed
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+        return data
+
+    def stats(self):
+        '''
+        Report the number of requests and connections made so far and
+        the per-request latency.
+
+        Returns: dict
+        '''
+        pools = self.pool_manager.pools
+        num_connections = sum(pools[key].num_connections
+                              for key in list(pools.keys()))
+
+        with self.lock:
+            mean_latency = (self.total_latency / self.num_requests
+                            if self.num_requests else 0.0)
+            return {"requests": self.num_requests,
+                    "failures": self.num_failures,
+                    "connections": num_connections,
+                    "mean_latency": mean_latency,
+                    "max_latency": self.max_latency}
+
+
+def get_client():
+    '''
+    Get the HTTP client shared by read_url, creating it on first use.
+
+    Returns: HttpClient
+    '''
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+
+    return _client
+
+
+def set_client(client):
+    '''
+    Replace the HTTP client shared by read_url (e.g. to change its pool
+    size, timeouts or retries).
+
+    Inputs:
+      - client (HttpClient): HTTP client
+    '''
+    global _client
+
+    _client = client
+
+
+def read_url(my_url, client=None):
     '''
     Load HTML from URL. Return result or empty string if the
     read fails.
 
     Inputs:
       - my_url (str): URL
+      - client (HttpClient): HTTP client to use, the shared client
+                             if not given
+
+    Returns: bytes
+    '''
+    if client is None:
+        client = get_client()
+
+    return client.get(my_url)
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket rate limiter. Tokens are added at a fixed
+    rate up to a maximum burst, and each request takes one token.
+    '''
+
+    def __init__(self, rate, burst=1):
+        '''
+        Inputs:
+          - rate (float): tokens added per second
+          - burst (int): maximum number of tokens held at once
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Block until a token is available, then take it.
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
 
-    Returns: str
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class PoliteFetcher:
+    '''
+    Wrap a fetch function so that it can be shared by many threads
+    while still being polite: all requests go through one global token
+    bucket, and at most per_host requests to the same host are in
+    flight at any time.
     '''
-    pm = urllib3.PoolManager(
-        cert_reqs="CERT_REQUIRED",
-        ca_certs=certifi.where())
 
-    return pm.urlopen(url=my_url, method="GET").data
+    def __init__(self, requests_per_second=1.0, burst=1, per_host=2,
+                 fetch=read_url):
+        '''
+        Inputs:
+          - requests_per_second (float): global request rate
+          - burst (int): number of requests allowed back to back
+          - per_host (int): maximum concurrent requests per host
+          - fetch (function): function taking a URL and returning HTML
+        '''
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.per_host = per_host
+        self.fetch = fetch
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def host_limit(self, url):
+        '''
+        Get the semaphore limiting concurrent requests to a URL's host.
+
+        Inputs:
+          - url (str): URL
+
+        Returns: Semaphore
+        '''
+        host = urllib.parse.urlparse(url).netloc
+
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.Semaphore(self.per_host)
+            return self.host_limits[host]
+
+    def __call__(self, url):
+        '''
+        Load HTML from URL once allowed by the rate and host limits.
+
+        Inputs:
+          - url (str): URL
+
+        Returns: str
+        '''
+        with self.host_limit(url):
+            self.bucket.acquire()
+            return self.fetch(url)
 
 
 def is_absolute_url(url):